@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the Tally converters against the paths they replace, the
+arrow format parser for dates and the general converter path for
+decimals and booleans.
+
+Run with ``python benchmarks/converters.py``. Dates are drawn from a
+single financial year, as they would be in a voucher register. The 'cold'
+figures use a fresh memo for every conversion and so measure the parsing
+fast path alone. The 'spread' figures draw dates from several years, more
+than the memo holds, and so measure the cost of memo misses.
+"""
+
+from __future__ import print_function
+
+import random
+import timeit
+from datetime import date
+from datetime import timedelta
+
+import arrow
+
+from tendril.connectors.tally.utils.converters import TXDate
+from tendril.connectors.tally.utils.converters import TXDateTime
+from tendril.connectors.tally.utils.converters import TXDecimal
+from tendril.connectors.tally.utils.converters import TXBoolean
+from tendril.connectors.tally.utils.converters import TallyPropertyConverter
+
+
+N = 20000
+
+
+def _dates(days=365):
+    start = date(2018, 4, 1)
+    return [start + timedelta(days=random.randrange(days)) for _ in range(N)]
+
+
+def _arrow_date(s):
+    return arrow.get(s, 'YYYYMMDD')
+
+
+def _arrow_datetime(s):
+    return arrow.get(' '.join([x.strip() for x in s.split('at')]),
+                     'D-MMM-YYYY HH:mm')
+
+
+def _general(converter):
+    # The general converter path, which the fast paths bypass.
+    def _convert(s):
+        return TallyPropertyConverter.from_tallyxml(converter, s)
+    return _convert
+
+
+def _run(name, func, values, reset=None):
+    def _loop():
+        for v in values:
+            if reset:
+                reset()
+            func(v)
+    elapsed = min(timeit.repeat(_loop, number=1, repeat=3))
+    print("{0:<28} {1:8.1f} ms  {2:6.2f} us/value"
+          "".format(name, elapsed * 1000, elapsed * 1e6 / len(values)))
+    return elapsed
+
+
+def main():
+    dates = _dates()
+    date_strings = [d.strftime('%Y%m%d') for d in dates]
+    datetime_strings = ['{0}-{1} at {2:02d}:{3:02d}'.format(
+        d.day, d.strftime('%b-%Y'), random.randrange(24), random.randrange(60))
+        for d in dates]
+
+    txd = TXDate()
+    txdt = TXDateTime()
+
+    print("TXDate, {0} values".format(N))
+    base = _run("arrow.get", _arrow_date, date_strings)
+    cold = _run("TXDate (cold)", txd.from_tallyxml, date_strings,
+                reset=txd._memo.clear)
+    warm = _run("TXDate (memoized)", txd.from_tallyxml, date_strings)
+    spread_strings = [d.strftime('%Y%m%d') for d in _dates(days=365 * 20)]
+    txd._memo.clear()
+    spread = _run("TXDate (spread)", txd.from_tallyxml, spread_strings)
+    print("Speedup: {0:.1f}x cold, {1:.1f}x memoized, {2:.1f}x spread"
+          "".format(base / cold, base / warm, base / spread))
+    print()
+
+    print("TXDateTime, {0} values".format(N))
+    base = _run("arrow.get", _arrow_datetime, datetime_strings)
+    fast = _run("TXDateTime", txdt.from_tallyxml, datetime_strings)
+    print("Speedup: {0:.1f}x".format(base / fast))
+    print()
+
+    decimal_strings = ['{0:.2f}'.format(random.uniform(-1e5, 1e5))
+                       for _ in range(N)]
+    txdec = TXDecimal()
+    print("TXDecimal, {0} values".format(N))
+    base = _run("general path", _general(txdec), decimal_strings)
+    fast = _run("TXDecimal", txdec.from_tallyxml, decimal_strings)
+    print("Speedup: {0:.1f}x".format(base / fast))
+    print()
+
+    boolean_strings = [random.choice(['Yes', 'No']) for _ in range(N)]
+    txb = TXBoolean()
+    print("TXBoolean, {0} values".format(N))
+    base = _run("general path", _general(txb), boolean_strings)
+    fast = _run("TXBoolean", txb.from_tallyxml, boolean_strings)
+    print("Speedup: {0:.1f}x".format(base / fast))
+
+
+if __name__ == '__main__':
+    main()
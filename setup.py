@@ -36,6 +36,7 @@ core_dependencies = [
     'requests',
     'fs==0.5.4',
     'arrow',
+    'futures; python_version < "3.0"',
 ]
 
 install_requires = core_dependencies + ['wheel']
@@ -95,6 +96,7 @@ setup(
     entry_points={
         'console_scripts': [
             'tendril-versions = tendril.utils.versions:main',
+            'tendril-tally-cache = tendril.connectors.tally.utils.cachemanager:main',
         ]
     },
     include_package_data=True
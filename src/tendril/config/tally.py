@@ -18,10 +18,96 @@ config_elements_tally = [
         "9002",
         "Tally port"
     ),
+    ConfigOption(
+        "TALLY_CONNECT_TIMEOUT",
+        "5",
+        "Timeout in seconds for establishing a connection to Tally"
+    ),
+    ConfigOption(
+        "TALLY_READ_TIMEOUT",
+        "600",
+        "Timeout in seconds for Tally to respond to a request"
+    ),
+    ConfigOption(
+        "TALLY_POOL_CONNECTIONS",
+        "2",
+        "Number of Tally hosts for which connection pools are kept"
+    ),
+    ConfigOption(
+        "TALLY_POOL_MAXSIZE",
+        "4",
+        "Maximum number of open connections to each Tally host"
+    ),
+    ConfigOption(
+        "TALLY_MAX_CONCURRENCY",
+        "4",
+        "Maximum number of concurrent Tally requests from the async "
+        "engine, for voucher list shards, and for masters collections"
+    ),
+    ConfigOption(
+        "TALLY_PARSER_BACKEND",
+        "'bs4'",
+        "Default parser backend for Tally XML responses, 'bs4' or 'lxml'"
+    ),
+    ConfigOption(
+        "TALLY_CONVERTER_MEMO_SIZE",
+        "4096",
+        "Number of most recently used date strings memoized by the Tally "
+        "date converter"
+    ),
     ConfigOption(
         "TALLY_CACHE",
         "os.path.join(SHAREDCACHE_ROOT, 'tally')",
         "Tally cache folder"
+    ),
+    ConfigOption(
+        "TALLY_CACHE_COMPRESSION",
+        "None",
+        "Compression for new Tally cache entries, one of 'gzip', 'zlib' "
+        "or 'lzma'. None to store them uncompressed"
+    ),
+    ConfigOption(
+        "TALLY_CACHE_KEY",
+        "None",
+        "Secret with which pickled Tally cache entries are authenticated. "
+        "Processes sharing the cache should use the same key. None to not "
+        "cache parsed content and voucher stores"
+    ),
+    ConfigOption(
+        "TALLY_CACHE_MAX_SIZE",
+        "None",
+        "Size in bytes up to which the Tally cache is allowed to grow "
+        "before entries are evicted. None for no limit"
+    ),
+    ConfigOption(
+        "TALLY_CACHE_EVICTION",
+        "'lru'",
+        "Eviction policy for the Tally cache, 'lru' or 'lfu'"
+    ),
+    ConfigOption(
+        "TALLY_MASTERS_FETCH_MODE",
+        "'all'",
+        "How company masters are fetched from Tally, 'all' for a single "
+        "All Masters request or 'collections' for concurrent requests for "
+        "each collection of masters"
+    ),
+    ConfigOption(
+        "TALLY_REGISTRY_MAXSIZE",
+        "32",
+        "Maximum number of companies for which masters, ledgers and stock "
+        "positions are each held in memory"
+    ),
+    ConfigOption(
+        "TALLY_REGISTRY_TTL",
+        "None",
+        "Age in seconds after which shared masters, ledgers and stock "
+        "positions are fetched afresh. None to keep them indefinitely"
+    ),
+    ConfigOption(
+        "TALLY_CACHE_TTL",
+        "None",
+        "Default age in seconds up to which cached Tally responses are used "
+        "without contacting Tally. None to use the cache only as a fallback"
     )
 ]
 
@@ -24,23 +24,40 @@ Tally XML Primitives and API Engine
 """
 
 
-from copy import copy
+from copy import deepcopy
+from hashlib import sha1
 from six import BytesIO
 from six import iteritems
-from six import string_types
 from inspect import isclass
+from threading import Lock
+from threading import Event
+from threading import RLock
 from collections import namedtuple
 
 from lxml import etree
-from bs4 import BeautifulSoup
-
-from requests import post
 from requests.exceptions import ConnectionError
+from requests.exceptions import Timeout
 from requests.structures import CaseInsensitiveDict
 
 from .utils.dates import get_date_range
 from .utils.converters import TallyPropertyConverter
 from .utils.cache import cachefs
+from .utils.cache import cache_age
+from .utils.cache import cache_write
+from .utils.cache import cache_open
+from .utils.cache import cache_create
+from .utils.cache import cache_commit
+from .utils.cache import cache_partial
+from .utils.cache import cache_miss
+from .utils.cache import cache_dumps
+from .utils.cache import cache_loads
+from .utils.cache import cache_pickles
+from .utils.cache import cache_safe_name
+from .utils.cache import revalidate
+from .utils.backends import get_backend
+from .utils.backends import get_node_backend
+from .utils.backends import NumericEntityReader
+from .utils import transport
 
 try:
     from tendril.config import TALLY_HOST
@@ -49,6 +66,11 @@ except ImportError:
     TALLY_HOST = 'localhost'
     TALLY_PORT = 9002
 
+try:
+    from tendril.config import TALLY_CACHE_TTL
+except ImportError:
+    TALLY_CACHE_TTL = None
+
 
 TallyQueryParameters = namedtuple('TallyQueryParameters',
                                   'header body')
@@ -59,6 +81,9 @@ TallyRequestHeader = namedtuple('TallyRequestHeader',
 TallyConversionSpec = namedtuple('TallyConversionSpec',
                                  'tag tx hardfail')
 
+TallyConversionPlan = namedtuple('TallyConversionPlan',
+                                 'attrs elements lists descendents fields')
+
 
 class TallyConversionError(Exception):
     pass
@@ -85,17 +110,276 @@ class TallyObject(object):
         self._soup = soup
 
 
+class TallyRecord(object):
+    """
+    Base class for compact, detached representations of TallyElements.
+
+    Record classes are generated for each TallyElement subclass by
+    :meth:`TallyElement.record_class`. They store the converted fields in
+    ``__slots__`` and carry the properties and methods of the element
+    class, but hold no reference to the parsed node or to the report. The
+    parse tree can therefore be freed once records have been created.
+    """
+    __slots__ = ('_company_name',)
+    _element_class = None
+
+    @property
+    def company_name(self):
+        return self._company_name
+
+    @property
+    def company_masters(self):
+        from . import masters
+        return masters.get_master(self.company_name)
+
+    def __getstate__(self):
+        return tuple(getattr(self, k) for k in self._record_fields)
+
+    def __setstate__(self, state):
+        for k, v in zip(self._record_fields, state):
+            setattr(self, k, v)
+
+    def __reduce__(self):
+        # Record classes are generated and cannot be pickled by reference.
+        # They are rebuilt on unpickling from the element class instead.
+        cls = self._element_class
+        origin = cls.__dict__.get('_projected_from', cls)
+        projection = cls.__dict__.get('_projection', None)
+        return _restore_record, (origin, projection, self.__getstate__())
+
+
+def _restore_record(origin, projection, state):
+    cls = origin
+    if projection is not None:
+        cls = origin.projected(projection)
+    rcls = cls.record_class()
+    record = rcls.__new__(rcls)
+    record.__setstate__(state)
+    return record
+
+
+_record_excluded = {
+    'elements', 'attrs', 'lists', 'descendent_elements',
+    '_compiled_plan', '_projections', '_record_class', '_schema_hash',
+    '_projected_from', '_projection',
+    '__dict__', '__weakref__', '__init__', '__getattr__',
+    '__module__', '__doc__', '__qualname__', '__slots__',
+}
+
+
+def _build_record_class(cls):
+    plan = cls._plan()
+    fields = tuple(step[0] for step in plan.attrs) + tuple(plan.fields)
+    namespace = {
+        '__slots__': fields,
+        '__module__': cls.__module__,
+        '_element_class': cls,
+        '_record_fields': ('_company_name',) + fields,
+    }
+    for klass in reversed(cls.__mro__):
+        if not issubclass(klass, TallyElement) or klass is TallyElement:
+            continue
+        for name, value in iteritems(klass.__dict__):
+            if name in _record_excluded or name in fields:
+                continue
+            namespace[name] = value
+    return type(cls.__name__, (TallyRecord,), namespace)
+
+
 class TallyElement(TallyObject):
+    """
+    Base class for Tally XML elements, populated from the parsed node
+    according to the ``attrs``, ``elements``, ``lists`` and
+    ``descendent_elements`` specifications of the subclass.
+
+    If the context (the report) is lazy, only ``attrs`` are converted when
+    the element is created. All other fields are converted from the node
+    when they are first accessed, and are then retained. Conversion errors
+    for these fields are correspondingly only raised on access.
+    """
     def __init__(self, soup, ctx=None):
         super(TallyElement, self).__init__(soup)
         self._ctx = ctx
-        self._populate()
+        self._backend = get_node_backend(soup)
+        if getattr(ctx, 'lazy', False):
+            self._lazy_indices = {}
+            self._populate_attrs(self._plan())
+        else:
+            self._populate()
 
     elements = {}
     descendent_elements = {}
     attrs = {}
     lists = {}
 
+    @classmethod
+    def _plan(cls):
+        # The conversion plan is compiled once for each class, on first use,
+        # and is not inherited by subclasses.
+        if '_compiled_plan' not in cls.__dict__:
+            cls._compiled_plan = _compile_plan(cls)
+        return cls._compiled_plan
+
+    @classmethod
+    def projected(cls, fields):
+        """
+        Return a subclass of this class which only converts the given
+        fields, along with ``name``, all ``attrs``, and any fields whose
+        converters are required. A field can be named either by its key or,
+        for keys with a leading underscore, by the key without it. Fields
+        which do not exist in this class are ignored. Projected classes are
+        cached.
+        """
+        fields = frozenset(fields)
+        if '_projections' not in cls.__dict__:
+            cls._projections = {}
+        if fields not in cls._projections:
+            def _keep(k, v):
+                if k in fields or k.lstrip('_') in fields or k == 'name':
+                    return True
+                return getattr(v[1], 'required', False)
+
+            def _project(specs):
+                return {k: v for k, v in iteritems(specs) if _keep(k, v)}
+
+            cls._projections[fields] = type(cls.__name__, (cls,), {
+                '__module__': cls.__module__,
+                '_projected_from': cls,
+                '_projection': fields,
+                'attrs': cls.attrs,
+                'elements': _project(cls.elements),
+                'lists': _project(cls.lists),
+                'descendent_elements': _project(cls.descendent_elements),
+            })
+        return cls._projections[fields]
+
+    @classmethod
+    def record_class(cls):
+        """
+        Return the compact :class:`TallyRecord` class corresponding to
+        this class, generating it on first use.
+        """
+        if '_record_class' not in cls.__dict__:
+            cls._record_class = _build_record_class(cls)
+        return cls._record_class
+
+    @classmethod
+    def schema(cls):
+        """
+        Return a hash identifying the fields of this class, their tags and
+        converters, including those of child element classes. Parsed
+        content cached under one schema is not used under another.
+        """
+        if '_schema_hash' not in cls.__dict__:
+            parts = []
+            for kind, specs in (('attrs', cls.attrs),
+                                ('elements', cls.elements),
+                                ('lists', cls.lists),
+                                ('descendents', cls.descendent_elements)):
+                for key in sorted(specs.keys()):
+                    spec = TallyConversionSpec(*specs[key])
+                    if isclass(spec.tx) and issubclass(spec.tx, TallyElement):
+                        tx = spec.tx.schema()
+                    else:
+                        tx = type(spec.tx).__name__
+                        tx += str(getattr(spec.tx, 'required', False))
+                    parts.append('{0}:{1}:{2}:{3}:{4}'.format(
+                        kind, key, spec.tag, tx, spec.hardfail))
+            cls._schema_hash = sha1(
+                '|'.join(parts).encode('utf-8')).hexdigest()[:16]
+        return cls._schema_hash
+
+    @classmethod
+    def from_record(cls, record, ctx=None):
+        """
+        Return an element of this class with the contents of the given
+        :class:`TallyRecord`. The element is fully populated and is not
+        backed by a parsed node.
+        """
+        obj = cls.__new__(cls)
+        obj._soup = None
+        obj._ctx = ctx
+        obj._backend = None
+        for k in record._record_fields[1:]:
+            val = getattr(record, k)
+            if isinstance(val, TallyRecord):
+                val = val._element_class.from_record(val, ctx)
+            elif isinstance(val, list):
+                val = [x._element_class.from_record(x, ctx)
+                       if isinstance(x, TallyRecord) else x for x in val]
+            obj.__dict__[k] = val
+        return obj
+
+    def to_record(self):
+        """
+        Return a compact, detached :class:`TallyRecord` with the contents
+        of this element. Child elements are converted recursively.
+        """
+        rcls = self.record_class()
+        record = rcls.__new__(rcls)
+        record._company_name = getattr(self._ctx, 'company_name', None)
+        for k in rcls.__slots__:
+            val = getattr(self, k)
+            if isinstance(val, TallyElement):
+                val = val.to_record()
+            elif isinstance(val, list):
+                val = [x.to_record() if isinstance(x, TallyElement) else x
+                       for x in val]
+            setattr(record, k, val)
+        return record
+
+    @classmethod
+    def spec_tags(cls):
+        tags = set()
+        for specs in (cls.attrs, cls.elements,
+                      cls.lists, cls.descendent_elements):
+            for v in specs.values():
+                tag = v[0]
+                if tag.endswith('.list'):
+                    tag = tag[:-len('.list')]
+                tags.add(tag)
+        return tags
+
+    def __getattr__(self, item):
+        # Only reached for attributes which are not yet set, which for
+        # lazily populated elements includes unconverted fields.
+        try:
+            indices = self.__dict__['_lazy_indices']
+            kind, step = self._plan().fields[item]
+        except KeyError:
+            raise AttributeError(item)
+        recursive = kind == 'descendents'
+        if recursive not in indices:
+            indices[recursive] = self._index(recursive=recursive)
+        key, tag, convert, spec = step
+        text = self._backend.text
+        if kind == 'lists':
+            val = [self._convert(convert, spec, [c], text)
+                   for c in indices[recursive].get(tag, [])]
+        else:
+            val = self._convert(convert, spec,
+                                indices[recursive].get(tag), text)
+        self.__dict__[key] = val
+        return val
+
+    def materialize(self):
+        """
+        Convert all fields of a lazily populated element which have not
+        yet been accessed, recursing into child elements.
+        """
+        if '_lazy_indices' not in self.__dict__:
+            return self
+        for k in self._plan().fields:
+            val = getattr(self, k)
+            if isinstance(val, TallyElement):
+                val.materialize()
+            elif isinstance(val, list):
+                for item in val:
+                    if isinstance(item, TallyElement):
+                        item.materialize()
+        del self._lazy_indices
+        return self
+
     @property
     def company_name(self):
         return self._ctx.company_name
@@ -106,73 +390,93 @@ class TallyElement(TallyObject):
         from . import masters
         return masters.get_master(self.company_name)
 
-    def _convert_from_tally(self, spec, candidates):
+    def _convert(self, convert, spec, candidates, text):
         try:
-            if len(candidates) == 0:
-                raise TallyTagNotFound(spec, self.name)
+            if not candidates:
+                raise TallyTagNotFound(spec, self.__dict__.get('name'))
             if len(candidates) > 1:
                 raise TallyTagAmbiguous(spec, candidates)
-
-            elif isinstance(candidates[0], string_types):
-                candidate_text = candidates[0]
-            elif isclass(spec.tx) and issubclass(spec.tx, TallyElement):
-                candidate_text = candidates[0]
-            elif isinstance(spec.tx, TallyPropertyConverter):
-                candidate_text = candidates[0].text
-            else:
-                raise TallyConverterNotSupported(spec, candidates)
-            if isinstance(spec.tx, TallyPropertyConverter):
-                return spec.tx.from_tallyxml(candidate_text)
-            elif isclass and issubclass(spec.tx, TallyElement):
-                return spec.tx(candidate_text, self._ctx)
-            else:
-                raise TallyConverterNotSupported(spec, candidates)
+            return convert(candidates[0], self._ctx, text)
         except TallyConversionError:
             if spec.hardfail:
                 raise
             else:
                 return None
 
-    def _process_elements(self, elements=None, recursive=False):
-        if elements is None:
-            elements = self.elements
-        for k, v in iteritems(elements):
-            spec = TallyConversionSpec(*v)
-            try:
-                candidates = self._soup.findChildren(v[0], recursive=recursive)
-            except AttributeError as e:
-                raise TallyTagNotFound(spec, e)
-            val = self._convert_from_tally(spec, candidates)
-            setattr(self, k, val)
-
-    def _process_descendent_elements(self):
-        self._process_elements(self.descendent_elements, recursive=True)
+    def _index(self, recursive=False):
+        try:
+            return self._backend.index(self._soup, recursive=recursive)
+        except AttributeError as e:
+            raise TallyTagNotFound(self.__class__, e)
 
-    def _process_attrs(self):
-        for k, v in iteritems(self.attrs):
-            spec = TallyConversionSpec(*v)
+    def _populate_attrs(self, plan):
+        values = self.__dict__
+        attr = self._backend.attr
+        for key, tag, convert, spec in plan.attrs:
             try:
-                candidate = self._soup.attrs[spec.tag]
+                candidate = attr(self._soup, tag)
             except KeyError as e:
                 raise TallyTagNotFound(spec, e)
-            val = self._convert_from_tally(spec, [candidate])
-            setattr(self, k, val)
-
-    def _process_lists(self):
-        for k, v in iteritems(self.lists):
-            spec = TallyConversionSpec(*v)
-            try:
-                candidates = self._soup.findChildren(v[0] + '.list', recursive=False)
-            except AttributeError as e:
-                raise TallyTagNotFound(spec, e)
-            val = [self._convert_from_tally(spec, [c]) for c in candidates]
-            setattr(self, k, val)
+            values[key] = self._convert(convert, spec, [candidate], None)
 
     def _populate(self):
-        self._process_attrs()
-        self._process_elements()
-        self._process_lists()
-        self._process_descendent_elements()
+        # All element and list specs are resolved against a single index of
+        # the children, instead of rescanning the children for each spec.
+        plan = self._plan()
+        values = self.__dict__
+        text = self._backend.text
+        self._populate_attrs(plan)
+        if plan.elements or plan.lists:
+            index = self._index()
+            for key, tag, convert, spec in plan.elements:
+                values[key] = self._convert(convert, spec,
+                                            index.get(tag), text)
+            for key, tag, convert, spec in plan.lists:
+                values[key] = [self._convert(convert, spec, [c], text)
+                               for c in index.get(tag, [])]
+        if plan.descendents:
+            index = self._index(recursive=True)
+            for key, tag, convert, spec in plan.descendents:
+                values[key] = self._convert(convert, spec,
+                                            index.get(tag), text)
+
+
+def _compile_converter(spec, from_node):
+    tx = spec.tx
+    if isinstance(tx, TallyPropertyConverter):
+        from_tallyxml = tx.from_tallyxml
+        if from_node:
+            def convert(candidate, ctx, text):
+                return from_tallyxml(text(candidate))
+        else:
+            def convert(candidate, ctx, text):
+                return from_tallyxml(candidate)
+    elif isclass(tx) and issubclass(tx, TallyElement):
+        def convert(candidate, ctx, text):
+            return tx(candidate, ctx)
+    else:
+        def convert(candidate, ctx, text):
+            raise TallyConverterNotSupported(spec, [candidate])
+    return convert
+
+
+def _compile_plan(cls):
+    steps = {}
+    fields = {}
+    for kind, specs, suffix, from_node in (
+            ('attrs', cls.attrs, '', False),
+            ('elements', cls.elements, '', True),
+            ('lists', cls.lists, '.list', True),
+            ('descendents', cls.descendent_elements, '', True)):
+        steps[kind] = []
+        for key, v in iteritems(specs):
+            spec = TallyConversionSpec(*v)
+            step = (key, spec.tag + suffix,
+                    _compile_converter(spec, from_node), spec)
+            steps[kind].append(step)
+            if kind != 'attrs':
+                fields[key] = (kind, step)
+    return TallyConversionPlan(fields=fields, **steps)
 
 
 class TallyReport(object):
@@ -180,27 +484,236 @@ class TallyReport(object):
     _container = None
     _cachename = None
     _content = {}
+    _single_pass = False
+    _cache_ttl = TALLY_CACHE_TTL
+    _stale_while_revalidate = False
+    _parsed_cache = True
+    _parsed_cache_version = 1
 
-    def __init__(self, company_name, dt=None, end_dt=None):
+    def __init__(self, company_name, dt=None, end_dt=None, backend=None,
+                 lazy=False, fields=None, compact=False, single_pass=None,
+                 reuse_cache=False, cache_ttl=None,
+                 stale_while_revalidate=None):
+        self._lock = RLock()
         self._xion = None
         self._soup = None
+        self._fingerprint = None
+        self._soup_source = None
+        self._reuse_cache = reuse_cache
+        if cache_ttl is not None:
+            self._cache_ttl = cache_ttl
+        if stale_while_revalidate is not None:
+            self._stale_while_revalidate = stale_while_revalidate
         self._dt = dt
         self._end_dt = end_dt
         self._company_name = company_name
+        self._backend = get_backend(backend)
+        self._lazy = lazy
+        self._fields = fields
+        self._compact = compact
+        if single_pass is not None:
+            self._single_pass = single_pass
 
     @property
     def company_name(self):
         return self._company_name
 
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def lazy(self):
+        return self._lazy
+
+    @property
+    def fields(self):
+        return self._fields
+
+    @property
+    def compact(self):
+        return self._compact
+
+    def _content_object(self, cls, node):
+        obj = cls(node, self)
+        if self._compact:
+            return obj.to_record()
+        return obj
+
+    def release(self):
+        """
+        Release the parsed response. Content collections which have not
+        yet been built will require the response to be acquired again.
+        """
+        with self._lock:
+            self._soup = None
+            self._soup_source = None
+            self._xion = None
+
+    def _content_class(self, item):
+        cls = self._content[item][1]
+        if self._fields:
+            cls = cls.projected(self._fields)
+        return cls
+
+    def _project_fetchlist(self, fetchlist, item):
+        # Drop FETCH entries for fields excluded by the projection.
+        if not self._fields:
+            return fetchlist
+        tags = self._content_class(item).spec_tags()
+        return [x for x in fetchlist if x.lower() in tags]
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = TallyXMLEngine.fingerprint(self._build_query())
+        return self._fingerprint
+
     @property
     def cachename(self):
+        # The fingerprint of the request distinguishes reports for
+        # different dates, filters or projections of the same company.
         if not self._cachename:
             return None
-        company_name = copy(self.company_name)
-        company_name = company_name.replace(' ', '_')
-        company_name = company_name.replace('.', '')
-        company_name = company_name.replace('-', '')
-        return "{0}.{1}".format(self._cachename, company_name)
+        return "{0}.{1}.{2}".format(self._cachename,
+                                    cache_safe_name(self.company_name),
+                                    self.fingerprint)
+
+    def _is_cached(self):
+        if not (cachefs and self.cachename):
+            return False
+        return cachefs.exists(self.cachename + '.xml')
+
+    def _cache_state(self):
+        # 'fresh' if the cached response is to be used as is, 'stale' if
+        # it is to be used while it is refreshed in the background, and
+        # None if Tally is to be queried first.
+        if not self._is_cached():
+            return None
+        if self._reuse_cache:
+            return 'fresh'
+        if self._cache_ttl is not None:
+            age = cache_age(self.cachename + '.xml')
+            if age is not None and age <= self._cache_ttl:
+                return 'fresh'
+        if self._stale_while_revalidate:
+            return 'stale'
+        return None
+
+    def _revalidate(self):
+        query = self._build_query()
+        cachename = self.cachename
+
+        def _refresh():
+            print("Refreshing cached response for {0}".format(cachename))
+            TallyXMLEngine().execute(query, cachename=cachename, parse=False)
+        revalidate(cachename, _refresh)
+
+    def _reads_cache(self):
+        # Whether cached responses are used other than as a fallback when
+        # Tally is not available.
+        return bool(self._reuse_cache or self._cache_ttl is not None or
+                    self._stale_while_revalidate)
+
+    def _use_cache(self):
+        state = self._cache_state()
+        if state == 'stale':
+            self._revalidate()
+        return state is not None
+
+    def _cache_source(self):
+        # Identifies the cached XML response, against which the parsed
+        # content cache is validated.
+        try:
+            info = cachefs.getinfo(self.cachename + '.xml')
+        except Exception:
+            return None
+        return info.get('size'), info.get('modified_time')
+
+    def _parsed_schema(self):
+        return tuple(sorted(
+            (item, self._content[item][0], self._content_class(item).schema())
+            for item in self._content.keys()
+        ))
+
+    def _read_parsed(self, source, track=True):
+        try:
+            with cache_open(self.cachename + '.pickle', track=track) as f:
+                version, schema, psource, collections = \
+                    cache_loads(f.read())
+        except Exception:
+            return {}
+        if version != self._parsed_cache_version or \
+                schema != self._parsed_schema() or psource != source:
+            return {}
+        return collections
+
+    def _load_parsed(self, items):
+        # Build the requested collections from the parsed content cache,
+        # provided it holds all of them and corresponds to the cached XML
+        # response. Returns False on a miss.
+        if not self._parsed_cache or not cache_pickles():
+            return False
+        collections = self._read_parsed(self._cache_source())
+        if not all(item in collections for item in items):
+            return False
+        print("Loading parsed content for {0} from {1}"
+              "".format(self.cachename, cachefs))
+        for item in items:
+            cls = self._content_class(item)
+            val = CaseInsensitiveDict()
+            for record in collections[item]:
+                if not self._compact:
+                    record = cls.from_record(record, self)
+                val[record.name] = record
+            self.__setattr__(item, val)
+        return True
+
+    def _save_parsed(self, built):
+        # Lazy reports are not saved, since that would require every
+        # element to be fully converted. Neither are reports which only
+        # use the cache as a fallback, for which parsed content is only
+        # read if it was saved by another report.
+        if not self._parsed_cache or self._lazy or not self._reads_cache():
+            return
+        if not cache_pickles():
+            return
+        if not (cachefs and self.cachename) or self._soup_source is None:
+            return
+        collections = self._read_parsed(self._soup_source, track=False)
+        for item, val in iteritems(built):
+            if self._compact:
+                collections[item] = list(val.values())
+            else:
+                collections[item] = [x.to_record() for x in val.values()]
+        try:
+            cache_write(self.cachename + '.pickle', cache_dumps(
+                (self._parsed_cache_version, self._parsed_schema(),
+                 self._soup_source, collections)
+            ))
+        except Exception as e:
+            print("Could not cache parsed content for {0} : {1}"
+                  "".format(self.cachename, e))
+
+    # Tags which are exported within another in TDL collections, and are
+    # fetched by the method which encloses them.
+    _fetch_aliases = {'name.list': 'languagename'}
+
+    def _build_fetchlist_for(self, item):
+        # FETCH entries for the fields of the content class of an item
+        # exported as a custom TDL collection. Attributes are always
+        # exported, and need not be fetched.
+        cls = self._content_class(item)
+        attr_tags = set(v[0] for v in cls.attrs.values())
+        fetchlist = set()
+        for specs in (cls.elements, cls.lists, cls.descendent_elements):
+            for v in specs.values():
+                tag = self._fetch_aliases.get(v[0], v[0])
+                if tag.endswith('.list'):
+                    tag = tag[:-len('.list')]
+                if tag not in attr_tags:
+                    fetchlist.add(tag.upper())
+        return sorted(fetchlist)
 
     @staticmethod
     def _build_fetchlist(parent, fetchlist):
@@ -208,6 +721,18 @@ class TallyReport(object):
             f = etree.SubElement(parent, 'FETCH')
             f.text = item
 
+    @staticmethod
+    def _build_tdl_filters(tdlmessage, collection, filters):
+        # filters maps names to TDL formulae. Each is applied to the
+        # collection and defined as a SYSTEM formula in the TDLMESSAGE.
+        for name in sorted(filters.keys()):
+            f = etree.SubElement(collection, 'FILTER')
+            f.text = name
+        for name in sorted(filters.keys()):
+            formula = etree.SubElement(tdlmessage, 'SYSTEM',
+                                       TYPE='Formulae', NAME=name)
+            formula.text = filters[name]
+
     def _set_request_date(self, svnode, dt=None, end_dt=None):
         if dt is None and self._dt:
             dt = self._dt
@@ -248,92 +773,448 @@ class TallyReport(object):
             rid.text = self._header.id
         return etree.ElementTree(h)
 
+    def _build_query(self):
+        return TallyQueryParameters(self._build_request_header(),
+                                    self._build_request_body())
+
     def _acquire_raw_response(self):
+        if self.cachename:
+            cache_miss(self.cachename + '.xml')
         self._xion = TallyXMLEngine()
-        query = TallyQueryParameters(self._build_request_header(),
-                                     self._build_request_body())
-        self._soup = self._xion.execute(query, cachename=self.cachename)
+        self._soup = self._xion.execute(self._build_query(),
+                                        cachename=self.cachename,
+                                        backend=self._backend)
+        if cachefs and self.cachename:
+            self._soup_source = self._cache_source()
 
     def _acquire_cached_raw_response(self):
         try:
-            with cachefs.open(self.cachename + '.xml', 'rb') as f:
+            source = self._cache_source()
+            with cache_open(self.cachename + '.xml') as f:
                 content = f.read()
-            self._soup = BeautifulSoup(content.decode('utf-8', 'ignore'), 'lxml')
+            self._soup = self._backend.parse(content)
+            self._soup_source = source
         except:
             raise TallyNotAvailable
 
-    @property
-    def soup(self):
-        if not self._soup:
+    def _acquire_soup(self, fallback=True):
+        # Called with the report lock held.
+        if self._soup is None and self._use_cache():
+            try:
+                self._acquire_cached_raw_response()
+            except TallyNotAvailable:
+                pass
+        if self._soup is None:
             try:
                 self._acquire_raw_response()
             except TallyNotAvailable:
-                if cachefs and self.cachename:
-                    print("Trying to return cached response for {0} from {1}"
-                          "".format(self.cachename, cachefs))
-                    self._acquire_cached_raw_response()
+                if fallback and cachefs and self.cachename:
+                    self._acquire_fallback_response()
                 else:
                     raise
-        return self._soup
 
-    def __getattr__(self, item):
+    def _acquire_fallback_response(self):
+        print("Trying to return cached response for {0} "
+              "from {1}".format(self.cachename, cachefs))
+        self._acquire_cached_raw_response()
+
+    @property
+    def soup(self):
+        with self._lock:
+            self._acquire_soup()
+            return self._soup
+
+    def _stream_elements(self, tag):
+        self._xion = TallyXMLEngine()
+        if self._use_cache():
+            try:
+                f = cache_open(self.cachename + '.xml')
+            except:
+                pass
+            else:
+                return self._xion.iterparse_source(f, tag)
+        if self.cachename:
+            cache_miss(self.cachename + '.xml')
+        try:
+            return self._xion.iterparse(self._build_query(), tag,
+                                        cachename=self.cachename)
+        except TallyNotAvailable:
+            if cachefs and self.cachename:
+                print("Trying to stream cached response for {0} from {1}"
+                      "".format(self.cachename, cachefs))
+                try:
+                    f = cache_open(self.cachename + '.xml')
+                except:
+                    raise TallyNotAvailable
+                return self._xion.iterparse_source(f, tag)
+            raise
+
+    def stream(self, item):
+        """
+        Generator yielding the objects of the named content collection one
+        at a time, as the response is parsed.
+
+        The response is read incrementally with lxml's ``iterparse``, and
+        each element is discarded once it has been converted, so memory use
+        does not grow with the size of the response. Collections obtained
+        this way are not retained by the report. Since the underlying nodes
+        are discarded, objects are fully converted even if the report is
+        lazy. If the report is compact, :class:`TallyRecord` instances are
+        yielded instead.
+
+        A streamed response holds a pooled connection until it has been
+        read. Streams abandoned before they are exhausted should be
+        closed, for example with :func:`contextlib.closing`, so that the
+        connection is returned to the pool without waiting for garbage
+        collection.
+        """
         if item not in self._content.keys():
             raise AttributeError(item)
+        tag = self._content[item][0]
+        cls = self._content_class(item)
+        elements = self._stream_elements(tag)
+        try:
+            for elem in elements:
+                obj = cls(self._backend.from_stream_element(elem, tag), self)
+                if self._compact:
+                    yield obj.to_record()
+                else:
+                    yield obj.materialize()
+        finally:
+            elements.close()
+
+    def iter_content(self, item):
+        """
+        Generator yielding the objects of the named content collection as
+        they are parsed, without retaining them in the report.
+
+        If the collection has already been built, its objects are yielded
+        from it. If the response has already been acquired, objects are
+        converted from it one at a time. Otherwise, the response is
+        streamed, and memory use remains bounded regardless of its size.
+        See :meth:`stream`.
+        """
+        if item not in self._content.keys():
+            raise AttributeError(item)
+        if item in self.__dict__:
+            for obj in self.__dict__[item].values():
+                yield obj
+        elif self._soup is not None:
+            soup = self._soup
+            if self._container:
+                soup = self._backend.find(soup, self._container)
+            cls = self._content_class(item)
+            for x in self._backend.findall(soup, self._content[item][0]):
+                yield self._content_object(cls, x)
+        else:
+            for obj in self.stream(item):
+                yield obj
+
+    def afetch(self, *content):
+        """
+        Return an awaitable which acquires the named content collections,
+        or all of them, without blocking the event loop. The awaitable
+        resolves to the report itself.
+
+        Requires Python 3.5 or newer. See :mod:`tendril.connectors.tally.aio`.
+        """
+        from .aio import fetch
+        return fetch(self, *content)
+
+    def _build_content(self, items):
+        # All the requested collections are built in a single walk over
+        # the response, with each node dispatched to the collections
+        # which want its tag. If the cached response is to be used, the
+        # collections are first sought in the parsed content cache, as
+        # they are if Tally is not available.
+        if self._soup is None:
+            if self._use_cache() and self._load_parsed(items):
+                return
+            try:
+                self._acquire_soup(fallback=False)
+            except TallyNotAvailable:
+                if not (cachefs and self.cachename):
+                    raise
+                if self._load_parsed(items):
+                    return
+                self._acquire_fallback_response()
         soup = self.soup
         if self._container:
-            soup = soup.find(self._container)
-        val = CaseInsensitiveDict()
-        for y in [self._content[item][1](x, self)
-                  for x in soup.findAll(self._content[item][0])]:
-            val[y.name] = y
-        self.__setattr__(item, val)
-        return val
+            soup = self._backend.find(soup, self._container)
+        targets = {}
+        collections = {}
+        for item in items:
+            tag = self._content[item][0]
+            val = CaseInsensitiveDict()
+            targets.setdefault(tag, []).append(
+                (self._content_class(item), val)
+            )
+            collections[item] = val
+        for x in self._backend.findall(soup, list(targets.keys())):
+            for cls, val in targets[self._backend.tag(x)]:
+                y = self._content_object(cls, x)
+                val[y.name] = y
+        for item, val in iteritems(collections):
+            self.__setattr__(item, val)
+        self._save_parsed(collections)
+        if self._compact and all(k in self.__dict__ for k in self._content):
+            # Compact records do not reference the parse tree, which can
+            # be freed once every collection has been built.
+            self.release()
+
+    def __getattr__(self, item):
+        if item not in self._content.keys():
+            raise AttributeError(item)
+        # Concurrent first accesses wait for a single build.
+        with self._lock:
+            if item in self.__dict__:
+                return self.__dict__[item]
+            if self._single_pass:
+                self._build_content([x for x in self._content.keys()
+                                     if x not in self.__dict__])
+            else:
+                self._build_content([item])
+            return self.__dict__[item]
+
+
+def _copy_tree(tree):
+    return etree.ElementTree(deepcopy(tree.getroot()))
+
+
+class _TeeReader(object):
+    def __init__(self, source, sink):
+        self._source = source
+        self._sink = sink
+
+    def read(self, size=-1):
+        data = self._source.read(size)
+        self._sink.write(data)
+        return data
+
+
+class _TallyResponseStream(object):
+    # Iterator over the elements of a streamed response. The pooled
+    # connection is released once it is exhausted or closed, including
+    # if it is never iterated, and when it is garbage collected.
+    def __init__(self, response, elements):
+        self._response = response
+        self._elements = elements
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._elements is None:
+            raise StopIteration
+        try:
+            return next(self._elements)
+        except StopIteration:
+            self.close()
+            raise
+
+    next = __next__
+
+    def close(self):
+        if self._elements is None:
+            return
+        elements, self._elements = self._elements, None
+        try:
+            elements.close()
+        finally:
+            self._response.close()
+
+    def __del__(self):
+        self.close()
+
+
+class _TallyFlight(object):
+    # A request in flight, whose outcome is shared by identical requests
+    # made while it is pending.
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = Lock()
 
 
 class TallyXMLEngine(object):
     """
     Very bare-bones architecture. Could do with more structure.  
+
+    Identical requests made by :meth:`execute` while one is already in
+    flight, from any thread, do not go to Tally. They wait for the pending
+    request instead, and share its parsed response or exception.
     """
     def __init__(self):
         self._query = None
         self._response = None
 
-    def execute(self, query, cachename=None):
+    @classmethod
+    def flight_key(cls, query, cachename=None, backend=None, parse=True):
+        return (cls.fingerprint(query), get_backend(backend).name,
+                cachename, parse)
+
+    def execute(self, query, cachename=None, backend=None, parse=True):
+        key = self.flight_key(query, cachename, backend, parse)
+        with _flights_lock:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = _TallyFlight()
+        if not leader:
+            print("Waiting on identical Tally request in flight")
+            flight.done.wait()
+            self.query = query
+            if flight.error is not None:
+                raise flight.error
+            self._response = flight.result
+            return self._response
+        try:
+            flight.result = self._execute(query, cachename, backend, parse)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with _flights_lock:
+                del _flights[key]
+            flight.done.set()
+        return flight.result
+
+    def _execute(self, query, cachename=None, backend=None, parse=True):
         self.query = query
-        headers = {'Content-Type': 'application/xml'}
         uri = 'http://{0}:{1}'.format(TALLY_HOST, TALLY_PORT)
         xmlstring = BytesIO()
         self.query.write(xmlstring)
         try:
             print("Sending Tally request to {0}".format(uri))
-            r = post(uri, data=xmlstring.getvalue(), headers=headers)
-        except ConnectionError as e:
+            r = transport.session.post(uri, data=xmlstring.getvalue(),
+                                       timeout=transport.timeout)
+        except (ConnectionError, Timeout) as e:
             print("Got Exception")
             print(e)
             raise TallyNotAvailable
         if cachefs and cachename:
-            with cachefs.open(cachename + '.xml', 'wb') as f:
-                f.write(r.content)
-        self._response = BeautifulSoup(r.content.decode('utf-8', 'ignore'), 'lxml')
+            cache_write(cachename + '.xml', r.content)
+        if not parse:
+            return None
+        self._response = get_backend(backend).parse(r.content)
         return self._response
 
+    def iterparse(self, query, tag, cachename=None):
+        """
+        Send the query to Tally and return a generator over the lxml
+        elements in the response with the given tag, which is parsed as it
+        is received. Each element is cleared, along with everything which
+        precedes it, once the consumer moves on to the next one.
+
+        :class:`TallyNotAvailable` is raised immediately if Tally cannot
+        be reached. If a cache name is provided, the response is written
+        to the cache as it streams through.
+        """
+        self.query = query
+        uri = 'http://{0}:{1}'.format(TALLY_HOST, TALLY_PORT)
+        xmlstring = BytesIO()
+        self.query.write(xmlstring)
+        try:
+            print("Streaming Tally request to {0}".format(uri))
+            r = transport.session.post(uri, data=xmlstring.getvalue(),
+                                       timeout=transport.timeout,
+                                       stream=True)
+        except (ConnectionError, Timeout) as e:
+            print("Got Exception")
+            print(e)
+            raise TallyNotAvailable
+        r.raw.decode_content = True
+        return _TallyResponseStream(
+            r, self._iterparse_response(r, tag, cachename)
+        )
+
+    def _iterparse_response(self, r, tag, cachename):
+        if not (cachefs and cachename):
+            with r:
+                for elem in self._iterparse(r.raw, tag):
+                    yield elem
+            return
+        completed = False
+        partial = cache_partial(cachename + '.xml')
+        with r, cache_create(partial) as f:
+            try:
+                for elem in self._iterparse(_TeeReader(r.raw, f), tag):
+                    yield elem
+                completed = True
+            finally:
+                if not completed:
+                    f.close()
+                    cachefs.remove(partial)
+        # The response is moved into place only once it is complete.
+        cache_commit(partial, cachename + '.xml')
+
+    def iterparse_source(self, source, tag):
+        """
+        Return a generator over the lxml elements with the given tag in
+        a file-like source, such as a cached response. The source is
+        closed once it is exhausted.
+        """
+        with source:
+            for elem in self._iterparse(source, tag):
+                yield elem
+
+    @staticmethod
+    def _iterparse(source, tag):
+        source = NumericEntityReader(source)
+        for _, elem in etree.iterparse(source, events=('end',),
+                                       tag=tag.upper(),
+                                       recover=True, huge_tree=True):
+            yield elem
+            # Elements already yielded are discarded, whether they are
+            # siblings, as in collection exports, or enclosed in siblings
+            # of their ancestors, as in TALLYMESSAGE wrappers.
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+            for ancestor in elem.iterancestors():
+                while ancestor.getprevious() is not None:
+                    del ancestor.getparent()[0]
+
     @staticmethod
     def _query_base():
         root = etree.Element('ENVELOPE')
         query = etree.ElementTree(root)
         return query
 
+    @classmethod
+    def _envelope(cls, params):
+        q = cls._query_base()
+        q.getroot().append(params.header.getroot())
+        body = etree.SubElement(q.getroot(), 'BODY')
+        body.append(params.body.getroot())
+        return q
+
+    @classmethod
+    def fingerprint(cls, params):
+        """
+        Return a short hash identifying the request described by the query
+        parameters, covering the header, company, dates, filters and
+        fetch lists. SVCURRENTDATE is excluded, since it changes daily
+        without changing the data selected by the request.
+        """
+        envelope = cls._envelope(TallyQueryParameters(
+            _copy_tree(params.header), _copy_tree(params.body)
+        ))
+        for node in envelope.getroot().iter('SVCURRENTDATE'):
+            node.getparent().remove(node)
+        return sha1(etree.tostring(envelope, method='c14n')).hexdigest()[:16]
+
     @property
     def query(self):
         return self._query
 
     @query.setter
     def query(self, params):
-        q = self._query_base()
-        q.getroot().append(params.header.getroot())
-        body = etree.SubElement(q.getroot(), 'BODY')
-        body.append(params.body.getroot())
-        self._query = q
+        self._query = self._envelope(params)
 
     @property
     def response(self):
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Asyncio Execution Engine for Tally Reports
+------------------------------------------
+
+Tally round trips and the parsing of their responses are run on a thread
+pool, so that a single event loop can drive many reports concurrently
+without blocking. The number of requests in flight at any time is bounded
+by ``TALLY_MAX_CONCURRENCY``.
+
+Identical requests made through :meth:`TallyAsyncXMLEngine.execute` while
+one is pending share it rather than each occupying a slot. Reports
+fetched with :func:`fetch` are coalesced in the same way by the
+underlying :class:`TallyXMLEngine`.
+
+This module requires Python 3.5 or newer.
+
+.. code-block:: python
+
+    from tendril.connectors.tally import aio
+    from tendril.connectors.tally import masters
+    from tendril.connectors.tally import stock
+
+    async def load(companies):
+        reports = [masters.get_master(c) for c in companies]
+        reports += [stock.get_position(c) for c in companies]
+        return await aio.gather(reports)
+
+"""
+
+import asyncio
+from functools import partial
+from weakref import WeakKeyDictionary
+from concurrent.futures import ThreadPoolExecutor
+
+from . import TallyXMLEngine
+from .utils.transport import TALLY_MAX_CONCURRENCY
+
+
+class TallyAsyncXMLEngine(object):
+    def __init__(self, max_concurrency=None):
+        self._max_concurrency = max_concurrency or TALLY_MAX_CONCURRENCY
+        self._executor = None
+        self._semaphores = WeakKeyDictionary()
+        self._flights = WeakKeyDictionary()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_concurrency)
+        return self._executor
+
+    def _semaphore(self, loop):
+        # asyncio primitives are bound to the loop they are first used on.
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self._max_concurrency)
+        return self._semaphores[loop]
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        async with self._semaphore(loop):
+            return await loop.run_in_executor(self.executor,
+                                              partial(func, *args))
+
+    async def execute(self, query, cachename=None, backend=None):
+        loop = asyncio.get_event_loop()
+        flights = self._flights.setdefault(loop, {})
+        key = TallyXMLEngine.flight_key(query, cachename, backend)
+        if key not in flights:
+            task = asyncio.ensure_future(self._run(
+                TallyXMLEngine().execute, query, cachename, backend
+            ))
+            flights[key] = task
+            task.add_done_callback(lambda _: flights.pop(key, None))
+        # A waiter being cancelled does not cancel the shared request.
+        return await asyncio.shield(flights[key])
+
+    async def fetch(self, report, *content):
+        def _acquire():
+            # Content is acquired through the content attributes, so that
+            # any report-like object with a _content map can be fetched.
+            items = content or list(report._content.keys())
+            prefetch = getattr(report, 'prefetch', None)
+            if prefetch is not None:
+                # Masters fetched by collection have no single response
+                # to acquire. Their collections are fetched concurrently.
+                prefetch(*items)
+            for item in items:
+                getattr(report, item)
+        await self._run(_acquire)
+        return report
+
+    async def gather(self, reports, *content):
+        return await asyncio.gather(
+            *[self.fetch(report, *content) for report in reports]
+        )
+
+
+engine = TallyAsyncXMLEngine()
+
+
+def fetch(report, *content):
+    return engine.fetch(report, *content)
+
+
+def gather(reports, *content):
+    return engine.gather(reports, *content)
@@ -30,6 +30,8 @@ from .utils.converters import TXDate
 from .utils.converters import TXString
 from .utils.converters import TXDecimal
 from .utils.converters import TXMultilineString
+from .utils.registry import TallyRegistry
+from .utils.registry import registry_key
 
 from . import TallyReport
 from . import TallyRequestHeader
@@ -138,15 +140,19 @@ class TallyLedgersList(TallyReport):
     }
 
 
-def get_list(company_name, force=False):
-    global _lists
-    if not force and company_name in _lists.keys():
-        return _lists[company_name]
-    try:
-        _lists[company_name] = TallyLedgersList(company_name)
-    except TallyNotAvailable:
-        _lists[company_name] = None
-    return _lists[company_name]
+def get_list(company_name, force=False, **kwargs):
+    if kwargs.get('fields'):
+        # Projected lists are built for the caller alone, and are not
+        # shared with other callers
+        return TallyLedgersList(company_name, **kwargs)
 
+    def _create():
+        try:
+            return TallyLedgersList(company_name, **kwargs)
+        except TallyNotAvailable:
+            return None
+    return _lists.get(registry_key(company_name, **kwargs), _create,
+                      force=force)
 
-_lists = {}
+
+_lists = TallyRegistry()
@@ -26,8 +26,17 @@ All Tally Masters
 
 
 from lxml import etree
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from requests.structures import CaseInsensitiveDict
+
+from .utils.registry import TallyRegistry
+from .utils.registry import registry_key
+from .utils.hierarchy import TallyHierarchy
+from .utils.transport import TALLY_MAX_CONCURRENCY
 
 from . import TallyReport
+from . import TallyRequestHeader
 from . import TallyNotAvailable
 
 from . import units
@@ -36,41 +45,371 @@ from . import ledgers
 from . import vouchers
 from . import currencies
 
+try:
+    from tendril.config import TALLY_MASTERS_FETCH_MODE
+except ImportError:
+    TALLY_MASTERS_FETCH_MODE = 'all'
+
+
+class TallyMasters(TallyReport):
+    """
+    All masters of a company.
+
+    With the default ``fetch_mode`` of ``all``, the masters are fetched in
+    a single 'All Masters' request. With ``collections``, each collection
+    of masters is instead fetched by its own :class:`TallyMasterCollection`
+    request, which only requests the fields of the corresponding element
+    class, or of its projection. Each collection is fetched on its first
+    access, and :meth:`prefetch` starts fetching several concurrently,
+    each becoming available as soon as its own request completes.
+    Collections are then cached, and can be refreshed with
+    :meth:`refresh`, independently. Other keyword arguments are passed on
+    to the collection reports.
+
+    Besides the collections of masters, hierarchy indexes and reverse
+    lookups, such as the stock items in a godown or with a given base
+    unit, are provided. These are built on first use from the collections
+    of this instance, and are retained with them.
+    """
+    _cachename = 'TallyMasters'
+    _single_pass = True
+    _fetch_mode = 'all'
+
+    # TDL object types of the collections of masters
+    _collection_types = {
+        'stockitems': 'StockItem',
+        'stockgroups': 'StockGroup',
+        'stockcategories': 'StockCategory',
+        'godowns': 'Godown',
+        'vouchertypes': 'VoucherType',
+        'units': 'Unit',
+        'ledgers': 'Ledger',
+        'currencies': 'Currency',
+    }
+
+    def __init__(self, company_name, fetch_mode=None, **kwargs):
+        super(TallyMasters, self).__init__(company_name, **kwargs)
+        self._fetch_mode = fetch_mode or TALLY_MASTERS_FETCH_MODE
+        if self._fetch_mode not in ('all', 'collections'):
+            raise ValueError("Unrecognized masters fetch mode : {0}"
+                             "".format(self._fetch_mode))
+        self._collection_kwargs = kwargs
+        self._collection_futures = {}
+        self._derived_names = set()
+
+    @property
+    def fetch_mode(self):
+        return self._fetch_mode
+
+    def _collection_report(self, item, **kwargs):
+        params = dict(self._collection_kwargs)
+        params.update(kwargs)
+        return TallyMasterCollection(self.company_name, item, **params)
+
+    def _fetch_collection(self, item, **kwargs):
+        return getattr(self._collection_report(item, **kwargs), item)
+
+    def prefetch(self, *items):
+        """
+        Start fetching the named collections, or all collections, in the
+        background. In the ``all`` fetch mode, collections are built
+        together from a single response on first access, and this does
+        nothing.
+        """
+        if self._fetch_mode == 'all':
+            return
+        items = items or self._content.keys()
+        with self._lock:
+            for item in items:
+                if item in self.__dict__ or \
+                        item in self._collection_futures:
+                    continue
+                self._collection_futures[item] = _executor().submit(
+                    self._fetch_collection, item
+                )
+
+    def refresh(self, *items):
+        """
+        Discard the named collections, or all collections, along with the
+        indexes built from them, so that they are fetched afresh from
+        Tally. Individual collections can only be refreshed in the
+        ``collections`` fetch mode.
+        """
+        if self._fetch_mode == 'all' and items and \
+                set(items) != set(self._content.keys()):
+            raise ValueError("Individual collections can only be refreshed "
+                             "in the 'collections' fetch mode")
+        items = items or list(self._content.keys())
+        with self._lock:
+            for item in items:
+                self.__dict__.pop(item, None)
+                self._collection_futures.pop(item, None)
+            for name in self._derived_names:
+                self.__dict__.pop(name, None)
+            self._derived_names.clear()
+            if self._fetch_mode == 'all':
+                self.release()
+                self._reuse_cache = False
+                self._cache_ttl = None
+                self._stale_while_revalidate = False
+                return
+            for item in items:
+                self._collection_futures[item] = _executor().submit(
+                    self._fetch_collection, item, reuse_cache=False,
+                    cache_ttl=0, stale_while_revalidate=False
+                )
+
+    def stream(self, item):
+        if self._fetch_mode == 'all':
+            return super(TallyMasters, self).stream(item)
+        if item not in self._content.keys():
+            raise AttributeError(item)
+        return self._collection_report(item).stream(item)
+
+    def iter_content(self, item):
+        if self._fetch_mode == 'all' or item in self.__dict__:
+            return super(TallyMasters, self).iter_content(item)
+        if item not in self._content.keys():
+            raise AttributeError(item)
+        if item in self._collection_futures:
+            return iter(getattr(self, item).values())
+        return self._collection_report(item).iter_content(item)
+
+    def __getattr__(self, item):
+        if self._fetch_mode == 'all' or item not in self._content.keys():
+            return super(TallyMasters, self).__getattr__(item)
+        self.prefetch(item)
+        with self._lock:
+            if item in self.__dict__:
+                return self.__dict__[item]
+            future = self._collection_futures[item]
+        # Wait outside the lock, so that other collections can be used as
+        # they become available.
+        try:
+            val = future.result()
+        except Exception:
+            # Failures are not retained, so that the next access retries.
+            with self._lock:
+                if self._collection_futures.get(item) is future:
+                    del self._collection_futures[item]
+            raise
+        with self._lock:
+            if self._collection_futures.get(item) is future:
+                self.__dict__[item] = val
+                del self._collection_futures[item]
+            if item in self.__dict__:
+                return self.__dict__[item]
+        return val
+
+    def _build_request_body(self):
+        r = etree.Element('EXPORTDATA')
+        rd = etree.SubElement(r, 'REQUESTDESC')
+        rn = etree.SubElement(rd, 'REPORTNAME')
+        rn.text = 'List of Accounts'
+        sv = etree.SubElement(rd, 'STATICVARIABLES')
+        self._set_request_staticvariables(sv)
+        at = etree.SubElement(sv, 'ACCOUNTTYPE')
+        at.text = 'All Masters'
+        return etree.ElementTree(r)
+
+    _content = {
+        'stockitems': ('stockitem', stock.TallyStockItem),
+        'stockgroups': ('stockgroup', stock.TallyStockGroup),
+        'stockcategories': ('stockcategory', stock.TallyStockCategory),
+        'godowns': ('godown', stock.TallyGodown),
+        'vouchertypes': ('vouchertype', vouchers.TallyVoucherType),
+        'units': ('unit', units.TallyUnit),
+        'ledgers': ('ledger', ledgers.TallyLedgerMaster),
+        'currencies': ('currency', currencies.TallyCurrency),
+    }
+
+    def _derived(self, name, build, collections=()):
+        # Indexes are built on first use and retained along with the
+        # collections they are built from. Those collections are acquired
+        # first, without holding the lock, so that other collections can
+        # be used while they are fetched.
+        for collection in collections:
+            getattr(self, collection)
+        with self._lock:
+            if name not in self.__dict__:
+                self.__dict__[name] = build()
+                self._derived_names.add(name)
+            return self.__dict__[name]
+
+    def _reverse_index(self, name, collection, keys, key):
+        # Return the objects in the collection indexed under key.
+        if not key:
+            return ()
+        return self._build_reverse_index(name, collection, keys).get(key, ())
+
+    def _build_reverse_index(self, name, collection, keys):
+        def _build():
+            index = CaseInsensitiveDict()
+            for obj in getattr(self, collection).values():
+                for key in keys(obj):
+                    index.setdefault(key, []).append(obj)
+            return CaseInsensitiveDict(
+                (k, tuple(v)) for k, v in index.items()
+            )
+        return self._derived(name, _build, (collection,))
+
+    @staticmethod
+    def _field_keys(field):
+        def _keys(obj):
+            value = getattr(obj, field, None)
+            return [value] if value else []
+        return _keys
+
+    @staticmethod
+    def _godown_keys(obj):
+        names = getattr(obj, '_godownname', None)
+        if not names:
+            return []
+        return set(names.split(':'))
+
+    @property
+    def stockgroup_hierarchy(self):
+        """
+        :class:`TallyHierarchy` of stock groups, with stock items as leaves.
+        """
+        def _build():
+            return TallyHierarchy(self.stockgroups, leaves=self.stockitems)
+        return self._derived('_stockgroup_hierarchy', _build,
+                             ('stockgroups', 'stockitems'))
+
+    @property
+    def stockcategory_hierarchy(self):
+        """
+        :class:`TallyHierarchy` of stock categories, with stock items as
+        leaves.
+        """
+        def _build():
+            return TallyHierarchy(self.stockcategories,
+                                  leaves=self.stockitems,
+                                  leaf_parent='_category')
+        return self._derived('_stockcategory_hierarchy', _build,
+                             ('stockcategories', 'stockitems'))
+
+    @property
+    def godown_hierarchy(self):
+        """
+        :class:`TallyHierarchy` of godowns.
+        """
+        def _build():
+            return TallyHierarchy(self.godowns)
+        return self._derived('_godown_hierarchy', _build, ('godowns',))
+
+    def items_under_group(self, name, recursive=True):
+        """
+        Return the stock items in the stock group and, if recursive, in all
+        the groups under it.
+        """
+        return self.stockgroup_hierarchy.leaves(name, recursive=recursive)
+
+    def items_in_group(self, name):
+        """
+        Return the stock items whose parent is the given stock group.
+        """
+        return self._reverse_index('_items_by_group', 'stockitems',
+                                   self._field_keys('_parent'), name)
+
+    def items_in_category(self, name):
+        return self._reverse_index('_items_by_category', 'stockitems',
+                                   self._field_keys('_category'), name)
+
+    def items_in_godown(self, name):
+        return self._reverse_index('_items_by_godown', 'stockitems',
+                                   self._godown_keys, name)
+
+    def items_by_unit(self, name):
+        """
+        Return the stock items with the given base unit.
+        """
+        return self._reverse_index('_items_by_unit', 'stockitems',
+                                   self._field_keys('_baseunits'), name)
+
+    def items_by_ledger(self, name):
+        return self._reverse_index('_items_by_ledger', 'stockitems',
+                                   self._field_keys('ledgername'), name)
+
+    def items_by_taxclassification(self, name):
+        return self._reverse_index(
+            '_items_by_taxclassification', 'stockitems',
+            self._field_keys('taxclassificationname'), name
+        )
+
+    def vouchertypes_by_parent(self, name):
+        return self._reverse_index('_vouchertypes_by_parent', 'vouchertypes',
+                                   self._field_keys('_parent'), name)
+
+
+class TallyMasterCollection(TallyReport):
+    """
+    A single collection of masters, such as the stock items or the units,
+    exported as a custom TDL collection. Only the fields of the element
+    class, or of its projection, are fetched.
+    """
+    _container = 'collection'
+
+    def __init__(self, company_name, item, **kwargs):
+        if item not in TallyMasters._collection_types:
+            raise ValueError("Unrecognized masters collection : {0}"
+                             "".format(item))
+        self._item = item
+        self._content = {item: TallyMasters._content[item]}
+        self._cachename = 'TallyMasters-{0}'.format(item)
+        self._header = TallyRequestHeader(
+            1, 'Export', 'Collection',
+            'Tendril {0}'.format(TallyMasters._collection_types[item])
+        )
+        super(TallyMasterCollection, self).__init__(company_name, **kwargs)
+
+    @property
+    def item(self):
+        return self._item
+
+    def _build_request_body(self):
+        r = etree.Element('DESC')
+        sv = etree.SubElement(r, 'STATICVARIABLES')
+        self._set_request_staticvariables(sv)
+        tdl = etree.SubElement(r, 'TDL')
+        tdlmessage = etree.SubElement(tdl, 'TDLMESSAGE')
+        collection = etree.SubElement(tdlmessage, 'COLLECTION', ISMODIFY='No',
+                                      NAME=self._header.id)
+        colltype = etree.SubElement(collection, 'TYPE')
+        colltype.text = TallyMasters._collection_types[self._item]
+        self._build_fetchlist(collection,
+                              self._build_fetchlist_for(self._item))
+        return etree.ElementTree(r)
+
+
+def _executor():
+    global _collection_executor
+    with _collection_executor_lock:
+        if _collection_executor is None:
+            _collection_executor = ThreadPoolExecutor(
+                max_workers=TALLY_MAX_CONCURRENCY
+            )
+        return _collection_executor
+
+
+_collection_executor = None
+_collection_executor_lock = Lock()
+
+
+def get_master(company_name, force=False, **kwargs):
+    if kwargs.get('fields'):
+        # Projected masters are built for the caller alone, and are not
+        # shared with other callers
+        return TallyMasters(company_name, **kwargs)
+
+    def _create():
+        try:
+            return TallyMasters(company_name, **kwargs)
+        except TallyNotAvailable:
+            return None
+    return _masters.get(registry_key(company_name, **kwargs), _create,
+                        force=force)
+
 
-def get_master(company_name, force=False):
-    class TallyMasters(TallyReport):
-        _cachename = 'TallyMasters'
-
-        def _build_request_body(self):
-            r = etree.Element('EXPORTDATA')
-            rd = etree.SubElement(r, 'REQUESTDESC')
-            rn = etree.SubElement(rd, 'REPORTNAME')
-            rn.text = 'List of Accounts'
-            sv = etree.SubElement(rd, 'STATICVARIABLES')
-            self._set_request_staticvariables(sv)
-            at = etree.SubElement(sv, 'ACCOUNTTYPE')
-            at.text = 'All Masters'
-            return etree.ElementTree(r)
-
-        _content = {
-            'stockitems': ('stockitem', stock.TallyStockItem),
-            'stockgroups': ('stockgroup', stock.TallyStockGroup),
-            'stockcategories': ('stockcategory', stock.TallyStockCategory),
-            'godowns': ('godown', stock.TallyGodown),
-            'vouchertypes': ('vouchertype', vouchers.TallyVoucherType),
-            'units': ('unit', units.TallyUnit),
-            'ledgers': ('ledger', ledgers.TallyLedgerMaster),
-            'currencies': ('currency', currencies.TallyCurrency),
-        }
-
-    global _masters
-    if not force and company_name in _masters.keys():
-        return _masters[company_name]
-    try:
-        _masters[company_name] = TallyMasters(company_name)
-    except TallyNotAvailable:
-        _masters[company_name] = None
-    return _masters[company_name]
-
-
-_masters = {}
+_masters = TallyRegistry()
@@ -30,6 +30,9 @@ from .utils.converters import TXBoolean
 from .utils.converters import TXString
 from .utils.converters import TXDecimal
 from .utils.converters import TXMultilineString
+from .utils.tdl import compile_filters
+from .utils.registry import TallyRegistry
+from .utils.registry import registry_key
 
 from . import TallyReport
 from . import TallyRequestHeader
@@ -76,10 +79,21 @@ class TallyStockGroup(TallyElement):
 
     @property
     def path(self):
-        if self.parent and self.parent.path:
-            return self.parent.path + [self.name]
-        else:
-            return [self.name]
+        return list(self.company_masters.stockgroup_hierarchy.path(self.name))
+
+    @property
+    def depth(self):
+        return self.company_masters.stockgroup_hierarchy.depth(self.name)
+
+    @property
+    def children(self):
+        masters = self.company_masters
+        return [masters.stockgroups[x]
+                for x in masters.stockgroup_hierarchy.children(self.name)]
+
+    @property
+    def stockitems(self):
+        return self.company_masters.items_under_group(self.name)
 
     @property
     def baseunits(self):
@@ -184,19 +198,24 @@ class TallyStockItem(TallyElement):
         if self._additionalunits:
             return self.company_masters.units[self._additionalunits]
 
+    def _group_attribute(self, attr):
+        # Items without their own method take that of their immediate
+        # group, but not those of groups further up.
+        if self._parent and self._parent != self.name:
+            hierarchy = self.company_masters.stockgroup_hierarchy
+            return hierarchy.inherited(self._parent, attr)
+
     @property
     def costingmethod(self):
         if self._costingmethod:
             return self._costingmethod
-        if self.parent:
-            return self.parent.costingmethod
+        return self._group_attribute('costingmethod')
 
     @property
     def valuationmethod(self):
         if self._valuationmethod:
             return self._valuationmethod
-        if self.parent:
-            return self.parent.valuationmethod
+        return self._group_attribute('valuationmethod')
 
     @property
     def openingbalance(self):
@@ -223,10 +242,10 @@ class TallyStockItem(TallyElement):
 
     @property
     def path(self):
-        if self.parent and self.parent.path:
-            return self.parent.path + [self.name]
-        else:
-            return [self.name]
+        if self._parent and self._parent != self.name:
+            hierarchy = self.company_masters.stockgroup_hierarchy
+            return list(hierarchy.path(self._parent)) + [self.name]
+        return [self.name]
 
     def __repr__(self):
         return "<TallyStockItem {0}>".format(self.name)
@@ -379,6 +398,10 @@ class TallyStockPosition(TallyReport):
     _header = TallyRequestHeader(1, 'Export', 'Collection',
                                  'All items under Groups')
 
+    def __init__(self, company_name, where=None, **kwargs):
+        super(TallyStockPosition, self).__init__(company_name, **kwargs)
+        self._tdl_filters = compile_filters(where)
+
     def _build_request_body(self):
         r = etree.Element('DESC')
         sv = etree.SubElement(r, 'STATICVARIABLES')
@@ -392,7 +415,9 @@ class TallyStockPosition(TallyReport):
         colltype.text = 'stock item'
         fetchlist = ['Name', 'Parent', 'BaseUnits',
                      'ClosingBalance', 'ClosingRate', 'ClosingValue']
+        fetchlist = self._project_fetchlist(fetchlist, 'stockitems')
         self._build_fetchlist(collection, fetchlist)
+        self._build_tdl_filters(tdlmessage, collection, self._tdl_filters)
         return etree.ElementTree(r)
 
     _container = 'collection'
@@ -401,15 +426,22 @@ class TallyStockPosition(TallyReport):
     }
 
 
-def get_position(company_name, dt=None, end_dt=None, force=False):
-    global _positions
-    if not force and company_name in _positions.keys() and not dt:
-        return _positions[company_name]
-    try:
-        _positions[company_name] = TallyStockPosition(company_name, dt=dt, end_dt=end_dt)
-    except TallyNotAvailable:
-        _positions[company_name] = None
-    return _positions[company_name]
+def get_position(company_name, dt=None, end_dt=None, force=False,
+                 **kwargs):
+    if kwargs.get('fields') or kwargs.get('where') is not None:
+        # Projected or filtered positions are built for the caller alone,
+        # and are not shared with other callers
+        return TallyStockPosition(company_name, dt=dt, end_dt=end_dt,
+                                  **kwargs)
+
+    def _create():
+        try:
+            return TallyStockPosition(company_name, dt=dt, end_dt=end_dt,
+                                      **kwargs)
+        except TallyNotAvailable:
+            return None
+    key = registry_key(company_name, dt=dt, end_dt=end_dt, **kwargs)
+    return _positions.get(key, _create, force=force or bool(dt))
 
 
-_positions = {}
+_positions = TallyRegistry()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Incremental Voucher Synchronization
+-----------------------------------
+
+Every alteration of a voucher in Tally assigns it a new AlterID, greater
+than any issued before it in that company. A :class:`TallyVoucherStore`
+keeps a local copy of a company's vouchers keyed by GUID, along with the
+highest AlterID it has seen in each period it has been synced for. Each
+sync only requests vouchers in the period altered since its mark, using
+a TDL filter on the collection, and merges them into the store.
+
+Marks are kept per period since a request only returns vouchers dated
+within it. A single mark would skip vouchers in other periods altered
+before it, such as those of a prior year synced for the first time, or
+edited since the last sync of that year. The default period, from the
+start of the current financial year to date, is keyed on its start
+alone, so that its mark is retained as the end moves forward.
+
+Vouchers marked as deleted are removed from the store. Cancelled vouchers
+are retained, since they continue to exist in Tally, but are excluded
+from :meth:`TallyVoucherStore.active`. Vouchers are held as compact
+records, and if the Tally cache is available and ``TALLY_CACHE_KEY`` is
+set, the store is persisted to it after each sync. A store persisted by
+another process is only loaded if both share the key.
+"""
+
+from requests.structures import CaseInsensitiveDict
+
+from .utils.cache import cachefs
+from .utils.cache import cache_open
+from .utils.cache import cache_write
+from .utils.cache import cache_dumps
+from .utils.cache import cache_loads
+from .utils.cache import cache_pickles
+from .utils.cache import cache_safe_name
+from .utils.dates import get_date_range
+from .vouchers import TallyVouchersCollection
+
+
+class TallyVoucherStore(object):
+    _cachename = 'TallyVoucherStore'
+    _version = 2
+
+    def __init__(self, company_name, persist=True):
+        self._company_name = company_name
+        self._persist = persist
+        self.alterids = {}
+        self.vouchers = CaseInsensitiveDict()
+        if self._persist:
+            self.load()
+
+    @property
+    def company_name(self):
+        return self._company_name
+
+    @property
+    def alterid(self):
+        """
+        The highest AlterID seen in any period.
+        """
+        return max(self.alterids.values()) if self.alterids else 0
+
+    @staticmethod
+    def period(dt=None, end_dt=None):
+        """
+        Return the key of the AlterID mark for the period requested with
+        the given dt and end_dt, as for :class:`TallyVouchersCollection`.
+        """
+        (start, end), _ = get_date_range(dt, end_dt)
+        if not dt:
+            return "{0}:".format(start.format('YYYY-MM-DD'))
+        return "{0}:{1}".format(start.format('YYYY-MM-DD'),
+                                end.format('YYYY-MM-DD'))
+
+    @property
+    def cachename(self):
+        return "{0}.{1}".format(self._cachename,
+                                cache_safe_name(self.company_name))
+
+    def load(self):
+        if not cachefs or not cache_pickles():
+            return
+        try:
+            with cache_open(self.cachename + '.pickle') as f:
+                version, alterids, vouchers = cache_loads(f.read())
+        except Exception:
+            return
+        if version != self._version:
+            return
+        self.alterids = alterids
+        self.vouchers = vouchers
+
+    def save(self):
+        if not cachefs or not cache_pickles():
+            return
+        cache_write(self.cachename + '.pickle', cache_dumps(
+            (self._version, self.alterids, self.vouchers)
+        ))
+
+    def merge(self, voucher, period=None):
+        if voucher.isdeleted:
+            self.vouchers.pop(voucher.guid, None)
+        else:
+            self.vouchers[voucher.guid] = voucher
+        if period is None:
+            return
+        if voucher.alterid and voucher.alterid > self.alterids.get(period, 0):
+            self.alterids[period] = voucher.alterid
+
+    def sync(self, dt=None, end_dt=None, **kwargs):
+        """
+        Fetch vouchers in the period altered since its last sync and merge
+        them into the store. Returns the number of vouchers received.
+        """
+        period = self.period(dt, end_dt)
+        report = TallyVouchersCollection(
+            self.company_name, dt=dt, end_dt=end_dt,
+            alterid=self.alterids.get(period, 0), compact=True, **kwargs
+        )
+        count = 0
+        for voucher in report.iter_content('vouchers'):
+            self.merge(voucher, period)
+            count += 1
+        if self._persist:
+            self.save()
+        return count
+
+    def active(self):
+        return [v for v in self.vouchers.values() if not v.iscancelled]
+
+
+def get_store(company_name, persist=True):
+    if company_name not in _stores.keys():
+        _stores[company_name] = TallyVoucherStore(company_name,
+                                                  persist=persist)
+    return _stores[company_name]
+
+
+def sync(company_name, dt=None, end_dt=None, **kwargs):
+    store = get_store(company_name)
+    store.sync(dt=dt, end_dt=end_dt, **kwargs)
+    return store
+
+
+_stores = {}
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tally XML Parser Backends
+-------------------------
+
+Parser backends encapsulate the parsing of Tally XML responses and the
+navigation of the resulting trees, so that ``TallyElement`` population
+does not depend on the tree implementation.
+
+  - ``bs4`` parses responses with BeautifulSoup over lxml's HTML parser.
+    Tag and attribute names are lowercased by the parser.
+  - ``lxml`` parses responses with lxml's XML parser and navigates the
+    tree with lxml's native C-level iterators. Tally emits uppercase tag
+    and attribute names, and lookups are uppercased accordingly.
+
+Both backends produce the same ``TallyElement`` contents. The backend used
+for a report is selected with the ``backend`` argument to ``TallyReport``,
+and defaults to ``TALLY_PARSER_BACKEND``.
+
+Tally writes characters which are not allowed in XML, such as the ``\x04``
+which prefixes reserved names like ``Not Applicable``, as character
+references. libxml2 recovers from these, but then silently drops every
+predefined named entity, such as ``&amp;``, which follows them. Responses
+parsed with lxml, including those which are streamed, therefore have
+these entities rewritten as the equivalent character references first.
+"""
+
+from lxml import etree
+from bs4 import BeautifulSoup
+from six import string_types
+
+try:
+    from tendril.config import TALLY_PARSER_BACKEND
+except ImportError:
+    TALLY_PARSER_BACKEND = 'bs4'
+
+
+_entities = (
+    (b'&amp;', b'&#38;'),
+    (b'&lt;', b'&#60;'),
+    (b'&gt;', b'&#62;'),
+    (b'&quot;', b'&#34;'),
+    (b'&apos;', b'&#39;'),
+)
+
+
+def numeric_entities(content):
+    """
+    Return the XML content with the predefined named entities replaced by
+    character references.
+    """
+    for entity, reference in _entities:
+        content = content.replace(entity, reference)
+    return content
+
+
+class NumericEntityReader(object):
+    """
+    File-like wrapper around an XML source, which replaces the predefined
+    named entities in its content with character references as it is read.
+    An entity split across reads is held back until it is complete.
+    """
+    _max_entity = max(len(e) for e, _ in _entities)
+
+    def __init__(self, source):
+        self._source = source
+        self._pending = b''
+
+    def read(self, size=-1):
+        while True:
+            chunk = self._source.read(size)
+            data = self._pending + chunk
+            self._pending = b''
+            if chunk:
+                idx = data.rfind(b'&')
+                if idx != -1 and b';' not in data[idx:] and \
+                        len(data) - idx < self._max_entity:
+                    self._pending = data[idx:]
+                    data = data[:idx]
+            if data or not chunk:
+                return numeric_entities(data)
+
+
+class TallyParserBackend(object):
+    name = None
+
+    def parse(self, content):
+        raise NotImplementedError
+
+    def from_stream_element(self, elem, tag):
+        raise NotImplementedError
+
+    def find(self, root, tag):
+        raise NotImplementedError
+
+    def findall(self, root, tags):
+        """
+        Return the descendants of root whose tag is the given tag, or any
+        of the given list of tags, in document order.
+        """
+        raise NotImplementedError
+
+    def tag(self, node):
+        """
+        Return the lowercased tag name of the node.
+        """
+        raise NotImplementedError
+
+    def children(self, node, tag, recursive=False):
+        raise NotImplementedError
+
+    def index(self, node, recursive=False):
+        """
+        Return a dictionary mapping lowercased tag names to lists of the
+        children of the node with that tag, in document order, built in a
+        single pass over the children. If recursive is True, all
+        descendants of the node are included.
+        """
+        raise NotImplementedError
+
+    def attr(self, node, name):
+        raise NotImplementedError
+
+    def text(self, node):
+        raise NotImplementedError
+
+
+class TallySoupBackend(TallyParserBackend):
+    name = 'bs4'
+
+    def parse(self, content):
+        return BeautifulSoup(content.decode('utf-8', 'ignore'), 'lxml')
+
+    def from_stream_element(self, elem, tag):
+        return BeautifulSoup(etree.tostring(elem), 'lxml').find(tag)
+
+    def find(self, root, tag):
+        return root.find(tag)
+
+    def findall(self, root, tags):
+        return root.findAll(tags)
+
+    def tag(self, node):
+        return node.name
+
+    def children(self, node, tag, recursive=False):
+        return node.findChildren(tag, recursive=recursive)
+
+    def index(self, node, recursive=False):
+        rval = {}
+        for child in (node.descendants if recursive else node.children):
+            if child.name is None:
+                continue
+            try:
+                rval[child.name].append(child)
+            except KeyError:
+                rval[child.name] = [child]
+        return rval
+
+    def attr(self, node, name):
+        return node.attrs[name]
+
+    def text(self, node):
+        return node.text
+
+
+class TallyLxmlBackend(TallyParserBackend):
+    name = 'lxml'
+
+    def __init__(self):
+        self._parser = etree.XMLParser(recover=True, huge_tree=True)
+
+    def parse(self, content):
+        content = content.decode('utf-8', 'ignore').encode('utf-8')
+        return etree.fromstring(numeric_entities(content),
+                                parser=self._parser)
+
+    def from_stream_element(self, elem, tag):
+        return elem
+
+    def find(self, root, tag):
+        tag = tag.upper()
+        if root.tag == tag:
+            return root
+        return next(root.iterdescendants(tag), None)
+
+    def findall(self, root, tags):
+        if isinstance(tags, string_types):
+            tags = [tags]
+        return root.iterdescendants(*[t.upper() for t in tags])
+
+    def tag(self, node):
+        return node.tag.lower()
+
+    def children(self, node, tag, recursive=False):
+        if recursive:
+            return list(node.iterdescendants(tag.upper()))
+        return list(node.iterchildren(tag.upper()))
+
+    def index(self, node, recursive=False):
+        rval = {}
+        for child in (node.iterdescendants() if recursive else node):
+            tag = child.tag
+            if not isinstance(tag, str):
+                # Comments and processing instructions
+                continue
+            tag = tag.lower()
+            try:
+                rval[tag].append(child)
+            except KeyError:
+                rval[tag] = [child]
+        return rval
+
+    def attr(self, node, name):
+        return node.attrib[name.upper()]
+
+    def text(self, node):
+        return ''.join(node.itertext())
+
+
+backends = {
+    'bs4': TallySoupBackend(),
+    'lxml': TallyLxmlBackend(),
+}
+
+
+def get_backend(backend=None):
+    if backend is None:
+        backend = TALLY_PARSER_BACKEND
+    if isinstance(backend, TallyParserBackend):
+        return backend
+    return backends[backend]
+
+
+def get_node_backend(node):
+    if isinstance(node, etree._Element):
+        return backends['lxml']
+    return backends['bs4']
@@ -21,19 +21,63 @@
 """
 Resources for Tally XML Caching
 -------------------------------
+
+Cache entries are optionally compressed on write, with the codec set by
+``TALLY_CACHE_COMPRESSION`` as one of ``gzip``, ``zlib`` or ``lzma``. Every
+entry, compressed or not, begins with a short header naming its codec,
+so entries written with any codec, or none, remain readable when the
+setting is changed. Entries are decompressed as they are read. Entries
+written without the header are recognised by the magic bytes of their
+codec, if any.
+
+Python objects, such as parsed content and voucher stores, are written
+to the cache with :func:`cache_dumps`. Since unpickling can execute
+arbitrary code, and the cache may be shared, these entries are
+authenticated with an HMAC keyed on ``TALLY_CACHE_KEY``, and entries
+which fail verification are not unpickled. If no key is configured,
+such entries are neither written nor read, as reported by
+:func:`cache_pickles`.
 """
 
+import os
+import gzip
+import zlib
+import hmac
+import pickle
+from hashlib import sha256
+from uuid import uuid4
+from datetime import datetime
+from threading import Lock
+from threading import Thread
+
 from fs.rpcfs import RPCFS
 from fs.opener import fsopendir
 from fs.errors import RemoteConnectionError
 
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
 try:
     from tendril.config import TALLY_CACHE
 except ImportError:
     TALLY_CACHE = None
 
+try:
+    from tendril.config import TALLY_CACHE_COMPRESSION
+except ImportError:
+    TALLY_CACHE_COMPRESSION = None
+
+try:
+    from tendril.config import TALLY_CACHE_KEY
+except ImportError:
+    TALLY_CACHE_KEY = None
+
 
 def _cache_init():
+    if not TALLY_CACHE:
+        return None
     if TALLY_CACHE.startswith('rpc://'):
         try:
             l_cache_fs = RPCFS('http://' + TALLY_CACHE[len('rpc://'):])
@@ -45,3 +89,342 @@ def _cache_init():
 
 
 cachefs = _cache_init()
+
+
+class _ZlibWriter(object):
+    def __init__(self, f):
+        self._f = f
+        self._compressor = zlib.compressobj()
+
+    def write(self, data):
+        self._f.write(self._compressor.compress(data))
+
+    def close(self):
+        self._f.write(self._compressor.flush())
+
+
+class _ZlibReader(object):
+    # Also reads gzip streams, with wbits = 16 + zlib.MAX_WBITS.
+    def __init__(self, f, wbits=zlib.MAX_WBITS):
+        self._f = f
+        self._decompressor = zlib.decompressobj(wbits)
+        self._buffer = b''
+
+    def read(self, size=-1):
+        if size < 0:
+            chunks = [self._buffer]
+            for chunk in iter(lambda: self._f.read(65536), b''):
+                chunks.append(self._decompressor.decompress(chunk))
+            chunks.append(self._decompressor.flush())
+            self._buffer = b''
+            return b''.join(chunks)
+        while len(self._buffer) < size:
+            chunk = self._f.read(65536)
+            if not chunk:
+                self._buffer += self._decompressor.flush()
+                break
+            self._buffer += self._decompressor.decompress(chunk)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        pass
+
+
+class _PrefixedReader(object):
+    # Returns the bytes already read to detect the codec before reading
+    # on from the underlying file.
+    def __init__(self, prefix, f):
+        self._prefix = prefix
+        self._f = f
+
+    def read(self, size=-1):
+        if not self._prefix:
+            return self._f.read(size)
+        if size < 0:
+            data, self._prefix = self._prefix + self._f.read(), b''
+            return data
+        data, self._prefix = self._prefix[:size], self._prefix[size:]
+        if len(data) < size:
+            data += self._f.read(size - len(data))
+        return data
+
+    def close(self):
+        pass
+
+
+# Every entry begins with _HEADER followed by the id of its codec. The
+# header cannot be mistaken for the start of an XML response or of a
+# compressed stream.
+_HEADER = b'\x00TXC'
+_codec_ids = {None: b'-', 'gzip': b'g', 'zlib': b'z', 'lzma': b'x'}
+_codec_names = dict((v, k) for k, v in _codec_ids.items())
+
+
+def _compressing_writer(f, codec):
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6)
+    if codec == 'zlib':
+        return _ZlibWriter(f)
+    if codec == 'lzma':
+        if lzma is None:
+            raise ValueError("lzma cache compression is not available")
+        return lzma.LZMAFile(f, 'wb')
+    raise ValueError("Unrecognized cache compression : {0}".format(codec))
+
+
+def _sniff_codec(magic):
+    # Entries written without the header are identified by the magic
+    # bytes of their codec.
+    if magic.startswith(b'\x1f\x8b'):
+        return 'gzip'
+    if magic.startswith(b'\xfd7zXZ\x00'):
+        return 'lzma'
+    if magic[:1] == b'\x78' and magic[1:2] in (b'\x01', b'\x5e',
+                                                 b'\x9c', b'\xda'):
+        return 'zlib'
+    return None
+
+
+def _decompressing_reader(f, codec):
+    if codec is None:
+        return f
+    if codec == 'gzip':
+        return _ZlibReader(f, wbits=16 + zlib.MAX_WBITS)
+    if codec == 'zlib':
+        return _ZlibReader(f)
+    if codec == 'lzma':
+        if lzma is None:
+            raise ValueError("lzma cache compression is not available")
+        return lzma.LZMAFile(f, 'rb')
+    raise ValueError("Unrecognized cache compression : {0}".format(codec))
+
+
+class TallyCacheFile(object):
+    """
+    File-like object for reading or writing a cache entry, compressing
+    or decompressing its content as it passes through.
+    """
+    def __init__(self, f, stream):
+        self._f = f
+        self._stream = stream
+        self._closed = False
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+    def write(self, data):
+        self._stream.write(data)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._stream is not self._f:
+                self._stream.close()
+        finally:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _manager():
+    from .cachemanager import manager
+    return manager
+
+
+def cache_safe_name(name):
+    """
+    Return the name, such as a company name, in a form usable as part of
+    the name of a cache entry.
+    """
+    return name.replace(' ', '_').replace('.', '').replace('-', '')
+
+
+def cache_open(path, track=True):
+    """
+    Open the cache entry at the given path for reading, returning a
+    file-like object which yields its decompressed content. Unless track
+    is False, the read is recorded as a hit by the cache manager.
+    """
+    f = cachefs.open(path, 'rb')
+    try:
+        magic = f.read(6)
+        if magic.startswith(_HEADER):
+            if magic[4:5] not in _codec_names:
+                raise ValueError("Unrecognized cache entry header : "
+                                 "{0!r}".format(magic[:5]))
+            codec = _codec_names[magic[4:5]]
+            source = _PrefixedReader(magic[5:], f)
+        else:
+            codec = _sniff_codec(magic)
+            source = _PrefixedReader(magic, f)
+        stream = _decompressing_reader(source, codec)
+    except:
+        f.close()
+        raise
+    if track and _manager():
+        _manager().record_hit(path)
+    return TallyCacheFile(f, stream)
+
+
+def cache_miss(path):
+    """
+    Record that the content for the cache entry at the given path had to
+    be obtained from Tally.
+    """
+    if cachefs and _manager():
+        _manager().record_miss(path)
+
+
+def cache_create(path, compression=None):
+    """
+    Create the cache entry at the given path for writing, returning a
+    file-like object which compresses the content written to it with the
+    given codec, or with ``TALLY_CACHE_COMPRESSION`` if none is given.
+    """
+    compression = compression or TALLY_CACHE_COMPRESSION
+    if compression not in _codec_ids:
+        raise ValueError("Unrecognized cache compression : "
+                         "{0}".format(compression))
+    f = cachefs.open(path, 'wb')
+    try:
+        f.write(_HEADER + _codec_ids[compression])
+        if not compression:
+            return TallyCacheFile(f, f)
+        stream = _compressing_writer(f, compression)
+    except:
+        f.close()
+        raise
+    return TallyCacheFile(f, stream)
+
+
+def cache_partial(path):
+    """
+    Return a unique name under which an entry for the given path can be
+    written before it is moved into place with :func:`cache_commit`.
+    """
+    return '{0}.{1}.partial'.format(path, uuid4().hex[:12])
+
+
+def cache_commit(partial, path):
+    """
+    Move a completely written cache entry into place.
+    """
+    if cachefs.exists(path):
+        cachefs.remove(path)
+    cachefs.rename(partial, path)
+    if _manager():
+        _manager().record_write(path, cachefs.getinfo(path).get('size', 0))
+
+
+def cache_write(path, content):
+    """
+    Write content to the cache entry at the given path. The content is
+    written alongside and then moved into place, so that concurrent
+    readers never see a partially written entry.
+    """
+    partial = cache_partial(path)
+    with cache_create(partial) as f:
+        f.write(content)
+    cache_commit(partial, path)
+
+
+def _cache_key():
+    if not TALLY_CACHE_KEY:
+        return os.urandom(32)
+    if isinstance(TALLY_CACHE_KEY, bytes):
+        return TALLY_CACHE_KEY
+    return TALLY_CACHE_KEY.encode('utf-8')
+
+
+_key = _cache_key()
+_key_reported = False
+
+
+def cache_pickles():
+    """
+    Whether Python objects are to be written to and read from the cache,
+    which requires ``TALLY_CACHE_KEY`` to be configured. The first time
+    this is found not to be the case, it is reported.
+    """
+    global _key_reported
+    if TALLY_CACHE_KEY:
+        return True
+    if not _key_reported:
+        _key_reported = True
+        print("TALLY_CACHE_KEY is not set. Parsed content and voucher "
+              "stores will not be cached.")
+    return False
+
+
+def cache_dumps(obj):
+    """
+    Return the pickled obj, prefixed with its HMAC, for writing to the
+    cache.
+    """
+    payload = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    return hmac.new(_key, payload, sha256).digest() + payload
+
+
+def cache_loads(content):
+    """
+    Return the object pickled by :func:`cache_dumps` in content. Raises
+    ValueError, without unpickling it, if the HMAC does not match.
+    """
+    digest, payload = content[:32], content[32:]
+    if not hmac.compare_digest(digest,
+                               hmac.new(_key, payload, sha256).digest()):
+        raise ValueError("Cache entry could not be authenticated")
+    return pickle.loads(payload)
+
+
+def cache_age(path):
+    """
+    Return the age in seconds of the cache entry at the given path, or
+    None if there is no such entry or its modification time is not known.
+    """
+    if not cachefs:
+        return None
+    try:
+        mtime = cachefs.getinfo(path).get('modified_time')
+    except Exception:
+        return None
+    if mtime is None:
+        return None
+    return (datetime.now() - mtime).total_seconds()
+
+
+_revalidating = set()
+_revalidating_lock = Lock()
+
+
+def revalidate(key, func):
+    """
+    Call func in a background thread to refresh the cache entry identified
+    by key, unless a refresh of the same entry is already in progress.
+    Returns True if a refresh was started.
+    """
+    with _revalidating_lock:
+        if key in _revalidating:
+            return False
+        _revalidating.add(key)
+
+    def _run():
+        try:
+            func()
+        except Exception as e:
+            print("Background refresh of {0} failed : {1}".format(key, e))
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(key)
+
+    t = Thread(target=_run, name='tally-revalidate')
+    t.daemon = True
+    t.start()
+    return True
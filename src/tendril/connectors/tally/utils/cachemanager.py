@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tally Cache Management
+----------------------
+
+Tracks the entries in the Tally cache in a small JSON index kept in the
+cache itself, recording the size, last access time and number of hits of
+each entry. When the total size of the cache exceeds
+``TALLY_CACHE_MAX_SIZE`` bytes, entries are evicted, least recently used
+first or, if ``TALLY_CACHE_EVICTION`` is ``lfu``, least frequently used
+first.
+
+The index may be shared by several processes using the same cache. Each
+process merges its own accesses, writes and removals into the index on
+disk when saving it, rather than overwriting it. Updates are saved in
+batches. Entries written or removed without the index are picked up from
+the cache itself when the index is first loaded, and when purging.
+
+Cache entries are named ``<Report>.<Company>.<...>``, which allows usage
+to be reported, and entries to be purged, by report type and company.
+The same is available from the command line :
+
+.. code-block:: console
+
+    $ tendril-tally-cache stats
+    $ tendril-tally-cache purge --report TallyVouchersList --company Co
+
+"""
+
+import os
+import json
+import time
+import atexit
+import argparse
+from threading import RLock
+
+from .cache import cachefs
+
+try:
+    from tendril.config import TALLY_CACHE_MAX_SIZE
+except ImportError:
+    TALLY_CACHE_MAX_SIZE = None
+
+try:
+    from tendril.config import TALLY_CACHE_EVICTION
+except ImportError:
+    TALLY_CACHE_EVICTION = 'lru'
+
+
+def entry_key(path):
+    """
+    Return the (report, company) to which a cache entry belongs.
+    """
+    parts = os.path.basename(path).split('.')
+    if len(parts) < 3:
+        return parts[0], None
+    return parts[0], parts[1]
+
+
+class TallyCacheManager(object):
+    _index_path = 'tally-cache-index.json'
+    _index_version = 1
+    _sync_interval = 20
+
+    def __init__(self, fs, max_size=None, eviction='lru'):
+        if eviction not in ('lru', 'lfu'):
+            raise ValueError("Unrecognized eviction policy : {0}"
+                             "".format(eviction))
+        self._fs = fs
+        self._max_size = max_size
+        self._eviction = eviction
+        self._lock = RLock()
+        self._index = None
+        self._pending = 0
+        self._delta = self._empty_delta()
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @property
+    def eviction(self):
+        return self._eviction
+
+    @property
+    def index(self):
+        with self._lock:
+            if self._index is None:
+                self._index = self._load_index()
+                self._reconcile(self._index)
+            return self._index
+
+    def _load_index(self):
+        try:
+            with self._fs.open(self._index_path, 'rb') as f:
+                index = json.loads(f.read().decode('utf-8'))
+            if index.get('version') != self._index_version:
+                raise ValueError
+        except Exception:
+            index = {'version': self._index_version,
+                     'hits': 0, 'misses': 0, 'entries': {}}
+        return index
+
+    def _reconcile(self, index):
+        # Track entries written without the index, and drop those no
+        # longer present. This lists the whole cache, so it is only done
+        # when the index is first loaded and when purging.
+        entries = index['entries']
+        present = set()
+        for path in self._fs.listdir(files_only=True):
+            if path == self._index_path or path.endswith('.partial'):
+                continue
+            present.add(path)
+            if path not in entries:
+                try:
+                    size = self._fs.getinfo(path).get('size', 0)
+                except Exception:
+                    continue
+                entries[path] = {'size': size, 'atime': time.time(),
+                                 'hits': 0}
+                self._written(path)
+        for path in list(entries.keys()):
+            if path not in present:
+                del entries[path]
+                self._removed(path)
+
+    @staticmethod
+    def _empty_delta():
+        # Hits and misses, and the entries written and removed, recorded
+        # since the index was last saved.
+        return {'hits': 0, 'misses': 0, 'entries': {},
+                'written': set(), 'removed': set()}
+
+    def _written(self, path):
+        self._delta['written'].add(path)
+        self._delta['removed'].discard(path)
+
+    def _removed(self, path):
+        self._delta['removed'].add(path)
+        self._delta['written'].discard(path)
+
+    def _merge(self, index):
+        # Merge the changes recorded by this process into an index read
+        # from disk, which reflects those saved by other processes.
+        # Entries this process neither wrote nor removed exist as the
+        # index on disk has them.
+        delta = self._delta
+        index['hits'] += delta['hits']
+        index['misses'] += delta['misses']
+        entries = index['entries']
+        for path in delta['removed']:
+            entries.pop(path, None)
+        for path, ours in self._index['entries'].items():
+            theirs = entries.get(path)
+            if theirs is None:
+                if path in delta['written']:
+                    entries[path] = dict(ours)
+                continue
+            hits = theirs['hits'] + delta['entries'].get(path, 0)
+            if ours['atime'] >= theirs['atime']:
+                theirs.update(ours)
+            theirs['hits'] = hits
+        return index
+
+    def save(self):
+        with self._lock:
+            if self._index is None:
+                return
+            self._index = self._merge(self._load_index())
+            self._delta = self._empty_delta()
+            content = json.dumps(self._index, sort_keys=True)
+            partial = self._index_path + '.partial'
+            try:
+                with self._fs.open(partial, 'wb') as f:
+                    f.write(content.encode('utf-8'))
+                if self._fs.exists(self._index_path):
+                    self._fs.remove(self._index_path)
+                self._fs.rename(partial, self._index_path)
+            except Exception as e:
+                print("Could not save the Tally cache index : {0}".format(e))
+            self._pending = 0
+
+    def _touch(self):
+        # Index updates are only persisted periodically, and at exit.
+        self._pending += 1
+        if self._pending >= self._sync_interval:
+            self.save()
+
+    def record_hit(self, path):
+        with self._lock:
+            index = self.index
+            index['hits'] += 1
+            self._delta['hits'] += 1
+            entry = index['entries'].get(path)
+            if entry is not None:
+                entry['hits'] += 1
+                entry['atime'] = time.time()
+                delta = self._delta['entries']
+                delta[path] = delta.get(path, 0) + 1
+            self._touch()
+
+    def record_miss(self, path):
+        with self._lock:
+            self.index['misses'] += 1
+            self._delta['misses'] += 1
+            self._touch()
+
+    def record_write(self, path, size):
+        with self._lock:
+            entries = self.index['entries']
+            entry = entries.setdefault(path, {'hits': 0})
+            entry['size'] = size
+            entry['atime'] = time.time()
+            self._written(path)
+            self.evict(keep=(path,))
+            self._touch()
+
+    def size(self):
+        with self._lock:
+            return sum(e['size'] for e in self.index['entries'].values())
+
+    def _eviction_order(self):
+        entries = self.index['entries']
+        if self._eviction == 'lfu':
+            def _key(path):
+                return entries[path]['hits'], entries[path]['atime']
+        else:
+            def _key(path):
+                return entries[path]['atime']
+        return sorted(entries.keys(), key=_key)
+
+    def _remove(self, path):
+        try:
+            if self._fs.exists(path):
+                self._fs.remove(path)
+        except Exception as e:
+            print("Could not remove cache entry {0} : {1}".format(path, e))
+            return False
+        self.index['entries'].pop(path, None)
+        self._removed(path)
+        return True
+
+    def _companions(self, path):
+        # Parsed content is only valid alongside the XML it was built
+        # from, and is removed with it.
+        if not path.endswith('.xml'):
+            return []
+        companion = path[:-len('.xml')] + '.pickle'
+        if companion in self.index['entries']:
+            return [companion]
+        return []
+
+    @staticmethod
+    def _sources(path):
+        # The XML which parsed content was built from, and which has to
+        # be kept along with it.
+        if not path.endswith('.pickle'):
+            return []
+        return [path[:-len('.pickle')] + '.xml']
+
+    def evict(self, max_size=None, keep=()):
+        """
+        Remove entries in eviction order until the total size of the cache
+        is within max_size, which defaults to the manager's budget.
+        Returns the list of removed entries.
+        """
+        max_size = max_size if max_size is not None else self._max_size
+        if max_size is None:
+            return []
+        removed = []
+        keep = set(keep)
+        for path in list(keep):
+            keep.update(self._sources(path))
+        with self._lock:
+            total = self.size()
+            for path in self._eviction_order():
+                if total <= max_size:
+                    break
+                if path in keep:
+                    continue
+                if path not in self.index['entries']:
+                    continue
+                companions = [p for p in self._companions(path)
+                              if p not in keep]
+                for p in [path] + companions:
+                    size = self.index['entries'][p]['size']
+                    if self._remove(p):
+                        total -= size
+                        removed.append(p)
+        return removed
+
+    def purge(self, report=None, company=None, older_than=None):
+        """
+        Remove the entries for the given report type and company, either
+        of which may be None to match all, and which have not been accessed
+        in older_than seconds, if given. Returns the list of removed
+        entries.
+        """
+        removed = []
+        now = time.time()
+        with self._lock:
+            self._reconcile(self.index)
+            for path, entry in list(self.index['entries'].items()):
+                if path not in self.index['entries']:
+                    continue
+                e_report, e_company = entry_key(path)
+                if report is not None and e_report != report:
+                    continue
+                if company is not None and e_company != company:
+                    continue
+                if older_than is not None and \
+                        now - entry['atime'] < older_than:
+                    continue
+                for p in [path] + self._companions(path):
+                    if self._remove(p):
+                        removed.append(p)
+            self.save()
+        return removed
+
+    def stats(self):
+        """
+        Return a dictionary with the size and number of entries of the
+        cache, overall and by report type and company, along with the
+        number of hits and misses and the hit rate.
+        """
+        with self._lock:
+            index = self.index
+            by_report = {}
+            by_company = {}
+            for path, entry in index['entries'].items():
+                report, company = entry_key(path)
+                for group, key in ((by_report, report),
+                                   (by_company, company)):
+                    g = group.setdefault(key, {'size': 0, 'entries': 0,
+                                               'hits': 0})
+                    g['size'] += entry['size']
+                    g['entries'] += 1
+                    g['hits'] += entry['hits']
+            requests = index['hits'] + index['misses']
+            return {
+                'size': self.size(),
+                'max_size': self._max_size,
+                'eviction': self._eviction,
+                'entries': len(index['entries']),
+                'hits': index['hits'],
+                'misses': index['misses'],
+                'hit_rate': index['hits'] / float(requests)
+                if requests else None,
+                'reports': by_report,
+                'companies': by_company,
+            }
+
+
+def _manager_init():
+    if not cachefs:
+        return None
+    m = TallyCacheManager(cachefs, max_size=TALLY_CACHE_MAX_SIZE,
+                          eviction=TALLY_CACHE_EVICTION)
+    atexit.register(m.save)
+    return m
+
+
+manager = _manager_init()
+
+
+def stats():
+    if not manager:
+        return None
+    return manager.stats()
+
+
+def purge(report=None, company=None, older_than=None):
+    if not manager:
+        return []
+    return manager.purge(report=report, company=company,
+                         older_than=older_than)
+
+
+def _print_stats(s):
+    print("Tally cache : {0} entries, {1} bytes, budget {2} ({3})"
+          "".format(s['entries'], s['size'], s['max_size'], s['eviction']))
+    hit_rate = '-' if s['hit_rate'] is None \
+        else '{0:.1%}'.format(s['hit_rate'])
+    print("Hits : {0}, Misses : {1}, Hit Rate : {2}"
+          "".format(s['hits'], s['misses'], hit_rate))
+    for title, group in (('Report', s['reports']),
+                         ('Company', s['companies'])):
+        print("")
+        print("{0:<32} {1:>8} {2:>14} {3:>8}"
+              "".format(title, 'Entries', 'Bytes', 'Hits'))
+        for key in sorted(group.keys(), key=str):
+            g = group[key]
+            print("{0:<32} {1:>8} {2:>14} {3:>8}"
+                  "".format(str(key), g['entries'], g['size'], g['hits']))
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description='Inspect and manage the Tally cache.'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('stats', help='Show cache usage and hit rate')
+    p_purge = subparsers.add_parser('purge', help='Remove cache entries')
+    p_purge.add_argument('--report', help='Only remove entries for this '
+                                          'report type')
+    p_purge.add_argument('--company', help='Only remove entries for this '
+                                           'company, as in entry names')
+    p_purge.add_argument('--older-than', type=float, metavar='SECONDS',
+                         help='Only remove entries not accessed in this '
+                              'many seconds')
+    p_evict = subparsers.add_parser('evict', help='Evict entries to bring '
+                                                  'the cache within budget')
+    p_evict.add_argument('--max-size', type=int, metavar='BYTES',
+                         help='Budget to evict to, instead of '
+                              'TALLY_CACHE_MAX_SIZE')
+    return parser
+
+
+def main(argv=None):
+    parser = _get_parser()
+    args = parser.parse_args(argv)
+    if not manager:
+        print("The Tally cache is not configured.")
+        return 1
+    if args.command == 'purge':
+        removed = manager.purge(report=args.report, company=args.company,
+                                older_than=args.older_than)
+        print("Removed {0} entries".format(len(removed)))
+    elif args.command == 'evict':
+        with manager._lock:
+            removed = manager.evict(max_size=args.max_size)
+            manager.save()
+        print("Evicted {0} entries".format(len(removed)))
+    else:
+        _print_stats(manager.stats())
+    return 0
+
+
+if __name__ == '__main__':
+    main()
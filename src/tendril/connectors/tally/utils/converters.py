@@ -23,8 +23,49 @@ Bidirectional Converters for Tally XML Data Types
 -------------------------------------------------
 """
 
+import re
 import arrow
 from decimal import Decimal
+from decimal import InvalidOperation
+from collections import OrderedDict
+
+try:
+    from tendril.config import TALLY_CONVERTER_MEMO_SIZE
+except ImportError:
+    TALLY_CONVERTER_MEMO_SIZE = 4096
+
+
+class _LRUMemo(object):
+    """
+    Memo of converted values for repeated Tally strings, such as the dates
+    in a voucher register, retaining up to maxsize of the most recently
+    used. Under concurrent use a value may occasionally be converted
+    again, but a wrong value is never returned.
+    """
+    def __init__(self, maxsize=TALLY_CONVERTER_MEMO_SIZE):
+        self.maxsize = maxsize
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def lookup(self, key):
+        # Raises KeyError on a miss.
+        value = self._values.pop(key)
+        self._values[key] = value
+        return value
+
+    def store(self, key, value):
+        self._values[key] = value
+        while len(self._values) > self.maxsize:
+            try:
+                self._values.popitem(last=False)
+            except KeyError:
+                break
+        return value
+
+    def clear(self):
+        self._values.clear()
 
 
 class TallyPropertyConverter(object):
@@ -38,12 +79,13 @@ class TallyPropertyConverter(object):
         raise NotImplementedError
 
     def from_tallyxml(self, soup):
-        if not soup.strip():
+        soup = soup.strip()
+        if not soup:
             if not self.required:
                 return None
             else:
                 raise ValueError
-        return self._from_tallyxml(soup.strip())
+        return self._from_tallyxml(soup)
 
     def to_tallyxml(self, value):
         if value is None:
@@ -79,6 +121,15 @@ class TXInteger(TallyPropertyConverter):
 
 
 class TXDecimal(TallyPropertyConverter):
+    def from_tallyxml(self, soup):
+        # Decimal ignores surrounding whitespace, so well formed values
+        # need not be stripped first. Anything else, including empty
+        # values, takes the general path.
+        try:
+            return Decimal(soup)
+        except (InvalidOperation, ValueError, TypeError):
+            return super(TXDecimal, self).from_tallyxml(soup)
+
     def _from_tallyxml(self, soup):
         return Decimal(soup)
 
@@ -87,12 +138,20 @@ class TXDecimal(TallyPropertyConverter):
 
 
 class TXBoolean(TallyPropertyConverter):
+    _values = {'Yes': True, 'No': False}
+
+    def from_tallyxml(self, soup):
+        # Values without surrounding whitespace are looked up directly.
+        try:
+            return self._values[soup]
+        except (KeyError, TypeError):
+            return super(TXBoolean, self).from_tallyxml(soup)
+
     def _from_tallyxml(self, soup):
-        if soup == 'Yes':
-            return True
-        elif soup == 'No':
-            return False
-        raise ValueError
+        try:
+            return self._values[soup]
+        except KeyError:
+            raise ValueError
 
     def _to_tallyxml(self, value):
         if value is True:
@@ -102,8 +161,20 @@ class TXBoolean(TallyPropertyConverter):
 
 
 class TXDate(TallyPropertyConverter):
+    _memo = _LRUMemo()
+
     def _from_tallyxml(self, soup):
-        return arrow.get(soup, 'YYYYMMDD')
+        # Arrow instances are immutable, and can be shared between the
+        # objects which carry the same date.
+        try:
+            return self._memo.lookup(soup)
+        except KeyError:
+            pass
+        if len(soup) == 8 and soup.isdigit():
+            value = arrow.Arrow(int(soup[:4]), int(soup[4:6]), int(soup[6:]))
+        else:
+            value = arrow.get(soup, 'YYYYMMDD')
+        return self._memo.store(soup, value)
 
     def _to_tallyxml(self, value):
         if isinstance(value, arrow.Arrow):
@@ -112,7 +183,21 @@ class TXDate(TallyPropertyConverter):
 
 
 class TXDateTime(TallyPropertyConverter):
+    # Datetimes are not memoized, since they rarely repeat.
+    _rex = re.compile(r'^(?P<day>\d{1,2})-(?P<month>[A-Za-z]{3})-'
+                      r'(?P<year>\d{4})\s*at\s*'
+                      r'(?P<hour>\d{2}):(?P<minute>\d{2})$')
+    _months = {m: i + 1 for i, m in enumerate(
+        ['jan', 'feb', 'mar', 'apr', 'may', 'jun',
+         'jul', 'aug', 'sep', 'oct', 'nov', 'dec'])}
+
     def _from_tallyxml(self, soup):
+        m = self._rex.match(soup)
+        month = m and self._months.get(m.group('month').lower())
+        if month:
+            return arrow.Arrow(int(m.group('year')), month,
+                               int(m.group('day')), int(m.group('hour')),
+                               int(m.group('minute')))
         return arrow.get(' '.join([x.strip() for x in soup.split('at')]),
                          'D-MMM-YYYY HH:mm')
 
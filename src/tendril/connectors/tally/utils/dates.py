@@ -136,3 +136,20 @@ def get_date_range(dt=None, end_dt=None):
             return get_calendar_year(ed, m.group('half'), m.group('quarter')), ed
     raise ValueError("Could not get a date range for {0}, {1}"
                      "".format(dt, end_dt))
+
+
+def split_date_range(start, end, period='month'):
+    """
+    Split the date range from start to end, both inclusive, into
+    consecutive shards aligned to calendar months or weeks. The first and
+    last shards are clipped to the range. Returns a list of (start, end)
+    tuples of arrow objects.
+    """
+    if period not in ('month', 'week'):
+        raise ValueError("Cannot split a date range by {0}".format(period))
+    start = arrow.get(start).floor('day')
+    end = arrow.get(end).floor('day')
+    shards = []
+    for s, e in arrow.Arrow.span_range(period, start, end):
+        shards.append((max(s, start), min(e.floor('day'), end)))
+    return shards
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hierarchy Index for Tally Masters
+---------------------------------
+
+Tally masters such as stock groups, stock categories and godowns form
+trees through their ``parent`` fields, with other masters, such as stock
+items, attached to them as leaves. A :class:`TallyHierarchy` is built once
+over such a collection. Paths, depths and ancestors of each node, the
+descendants of each node, and the leaves under it are then available
+without walking the parent chain through the masters on every access.
+Results are memoized.
+"""
+
+from requests.structures import CaseInsensitiveDict
+
+
+def _parent_name(obj, attr):
+    parent = getattr(obj, attr, None)
+    if parent and parent.lower() != obj.name.lower():
+        return parent
+    return None
+
+
+class TallyHierarchy(object):
+    """
+    Index over the nodes, a dictionary of masters keyed by name, and
+    optionally leaves, whose ``leaf_parent`` field names the node they
+    are attached to. Node names are matched case-insensitively, as in
+    the masters collections.
+
+    Nodes whose parent is not among the nodes are treated as roots. Where
+    parents form a cycle, paths stop short of repeating a node, and no
+    node is its own descendant.
+    """
+    def __init__(self, nodes, leaves=None, parent='_parent',
+                 leaf_parent='_parent'):
+        self._nodes = nodes
+        self._parents = CaseInsensitiveDict()
+        self._children = CaseInsensitiveDict()
+        self._leaves = CaseInsensitiveDict()
+        self._roots = []
+        for name, node in nodes.items():
+            self._children[node.name] = []
+            self._parents[node.name] = _parent_name(node, parent)
+        for name, parent_name in self._parents.items():
+            if parent_name is None or parent_name not in self._parents:
+                self._roots.append(name)
+            else:
+                self._children[parent_name].append(name)
+        for leaf in (leaves or {}).values():
+            parent_name = _parent_name(leaf, leaf_parent)
+            if parent_name is not None:
+                self._leaves.setdefault(parent_name, []).append(leaf)
+        self._paths = CaseInsensitiveDict()
+        self._cyclic = set()
+        self._descendants = CaseInsensitiveDict()
+        self._inherited = {}
+
+    @property
+    def roots(self):
+        return list(self._roots)
+
+    def __contains__(self, name):
+        return name in self._parents
+
+    def parent(self, name):
+        """
+        Return the name of the parent of the node, or None if it has
+        none. Raises KeyError for unknown nodes.
+        """
+        return self._parents[name]
+
+    def path(self, name):
+        """
+        Return the names of the nodes from the root down to, and
+        including, the given node, as a tuple.
+        """
+        if name not in self._paths:
+            chain = []
+            seen = set()
+            cyclic = False
+            current = name
+            while current is not None and current in self._nodes:
+                if current.lower() in seen:
+                    cyclic = True
+                    break
+                if current in self._paths and \
+                        current.lower() not in self._cyclic:
+                    chain.extend(reversed(self._paths[current]))
+                    break
+                seen.add(current.lower())
+                chain.append(self._nodes[current].name)
+                current = self._parents.get(current)
+            chain.reverse()
+            if cyclic:
+                # Within a cycle, the path depends on where it is entered,
+                # and is not reused for other nodes.
+                self._paths[name] = tuple(chain)
+                self._cyclic.add(name.lower())
+            else:
+                # Memoize the path of every node walked through.
+                for idx in range(len(chain)):
+                    if chain[idx] not in self._paths:
+                        self._paths[chain[idx]] = tuple(chain[:idx + 1])
+        return self._paths[name]
+
+    def depth(self, name):
+        """
+        Return the depth of the node, with roots at depth 0.
+        """
+        return len(self.path(name)) - 1
+
+    def ancestors(self, name):
+        """
+        Return the set of names of the ancestors of the node.
+        """
+        return frozenset(self.path(name)[:-1])
+
+    def children(self, name):
+        """
+        Return the names of the immediate children of the node.
+        """
+        return list(self._children.get(name, []))
+
+    def descendants(self, name):
+        """
+        Return the names of all nodes under the given node, in depth first
+        order.
+        """
+        if name not in self._descendants:
+            result = []
+            stack = list(reversed(self._children.get(name, [])))
+            seen = set([name.lower()])
+            while stack:
+                current = stack.pop()
+                if current.lower() in seen:
+                    continue
+                seen.add(current.lower())
+                result.append(current)
+                stack.extend(reversed(self._children.get(current, [])))
+            self._descendants[name] = tuple(result)
+        return self._descendants[name]
+
+    def leaves(self, name, recursive=True):
+        """
+        Return the leaves attached to the node and, if recursive, to all
+        nodes under it.
+        """
+        result = list(self._leaves.get(name, []))
+        if recursive:
+            for descendant in self.descendants(name):
+                result.extend(self._leaves.get(descendant, []))
+        return result
+
+    def inherited(self, name, attr, recursive=False):
+        """
+        Return the value of the given attribute of the node. If it is
+        empty and recursive is True, the value of the nearest ancestor for
+        which it is not empty is returned instead.
+        """
+        key = (name.lower(), attr, recursive)
+        if key not in self._inherited:
+            value = getattr(self._nodes[name], attr, None)
+            if not value and recursive:
+                for ancestor in reversed(self.path(name)[:-1]):
+                    value = getattr(self._nodes[ancestor], attr, None)
+                    if value:
+                        break
+            self._inherited[key] = value
+        return self._inherited[key]
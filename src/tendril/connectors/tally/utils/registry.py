@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Registries of Shared Reports
+----------------------------
+
+Thread-safe registries holding the reports shared by all users of the
+connector in a process, such as the masters of each company. Concurrent
+requests for a report which is not yet in the registry result in a single
+call to create it, with the other callers waiting on its result. The
+number of entries in a registry can be bounded, in which case the least
+recently used are dropped, and entries can be set to expire after a
+while, after which they are created afresh on the next request.
+
+Reports created with different options are distinct entries, keyed with
+:func:`registry_key`.
+"""
+
+import time
+from threading import Lock
+from collections import OrderedDict
+
+try:
+    from tendril.config import TALLY_REGISTRY_MAXSIZE
+except ImportError:
+    TALLY_REGISTRY_MAXSIZE = 32
+
+try:
+    from tendril.config import TALLY_REGISTRY_TTL
+except ImportError:
+    TALLY_REGISTRY_TTL = None
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [_freeze(x) for x in value]
+        if isinstance(value, (set, frozenset)):
+            items = sorted(items)
+        return tuple(items)
+    return value
+
+
+def registry_key(*args, **kwargs):
+    """
+    Return a hashable registry key for a report created with the given
+    arguments, independent of the order of the keyword arguments.
+    """
+    return _freeze(args), _freeze(kwargs)
+
+
+class TallyRegistry(object):
+    def __init__(self, maxsize=TALLY_REGISTRY_MAXSIZE,
+                 ttl=TALLY_REGISTRY_TTL):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._key_locks = {}
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def _lookup(self, key):
+        # Called with the registry lock held.
+        if key not in self._entries:
+            raise KeyError(key)
+        created, value = self._entries[key]
+        if self._ttl is not None and time.time() - created > self._ttl:
+            del self._entries[key]
+            raise KeyError(key)
+        # Mark as most recently used.
+        del self._entries[key]
+        self._entries[key] = (created, value)
+        return value
+
+    def _store(self, key, value):
+        # Called with the registry lock held.
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time(), value)
+        if self._maxsize is not None:
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, key, factory, force=False):
+        """
+        Return the entry for the key, calling factory to create it if it
+        is not present, has expired, or if force is True. Concurrent
+        requests for the same key wait on a single call to factory.
+        """
+        with self._lock:
+            if not force:
+                try:
+                    return self._lookup(key)
+                except KeyError:
+                    pass
+            key_lock = self._key_locks.setdefault(key, Lock())
+        with key_lock:
+            if not force:
+                # Another caller may have created it while we waited.
+                with self._lock:
+                    try:
+                        return self._lookup(key)
+                    except KeyError:
+                        pass
+            value = factory()
+            with self._lock:
+                self._store(key, value)
+                self._key_locks.pop(key, None)
+            return value
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self._lookup(key)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._entries[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            try:
+                self._lookup(key)
+            except KeyError:
+                return False
+            return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
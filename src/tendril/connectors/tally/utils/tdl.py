@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+TDL Filter Predicates
+---------------------
+
+Predicates over the methods of Tally objects, which are compiled into TDL
+formulae and applied as filters to the collections of a request, so that
+Tally only returns the matching objects.
+
+.. code-block:: python
+
+    from tendril.connectors.tally.utils.tdl import TallyField as F
+    from tendril.connectors.tally import vouchers
+
+    vouchers.get_list('Company', dt='FY19', where=[
+        F('PartyLedgerName') == 'Customer A',
+        F('Amount') > 10000,
+    ])
+
+Multiple predicates in a list must all hold. Predicates can also be
+combined with ``&``, ``|`` and ``~``, and arbitrary TDL formulae can be
+used with :class:`TallyFormula`.
+"""
+
+import arrow
+from datetime import date
+from decimal import Decimal
+from six import string_types
+from six import integer_types
+
+
+def tdl_literal(value):
+    if isinstance(value, bool):
+        return 'Yes' if value else 'No'
+    if isinstance(value, integer_types + (float, Decimal)):
+        return str(value)
+    if isinstance(value, arrow.Arrow):
+        value = value.date()
+    if isinstance(value, date):
+        return '$$Date:"{0}"'.format(value.strftime('%d-%m-%Y'))
+    if isinstance(value, string_types):
+        if '"' in value:
+            raise ValueError("TDL string literals cannot contain "
+                             "double quotes : {0}".format(value))
+        return '"{0}"'.format(value)
+    raise TypeError("Cannot express {0!r} in TDL".format(value))
+
+
+class TallyPredicate(object):
+    def formula(self):
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return TallyBooleanPredicate('AND', self, other)
+
+    def __or__(self, other):
+        return TallyBooleanPredicate('OR', self, other)
+
+    def __invert__(self):
+        return TallyFormula('NOT ({0})'.format(self.formula()))
+
+    def __repr__(self):
+        return "<{0} {1}>".format(self.__class__.__name__, self.formula())
+
+
+class TallyFormula(TallyPredicate):
+    def __init__(self, formula):
+        self._formula = formula
+
+    def formula(self):
+        return self._formula
+
+
+class TallyBooleanPredicate(TallyPredicate):
+    def __init__(self, operator, *predicates):
+        self._operator = operator
+        self._predicates = predicates
+
+    def formula(self):
+        joiner = ' {0} '.format(self._operator)
+        return joiner.join('({0})'.format(p.formula())
+                           for p in self._predicates)
+
+
+class TallyComparison(TallyPredicate):
+    def __init__(self, field, operator, value):
+        self._field = field
+        self._operator = operator
+        self._value = value
+
+    def formula(self):
+        return '{0} {1} {2}'.format(self._field.formula(), self._operator,
+                                    tdl_literal(self._value))
+
+
+class TallyField(object):
+    """
+    A method of the objects in a Tally collection, such as
+    ``PartyLedgerName`` or ``AlterID`` for vouchers.
+    """
+    def __init__(self, method):
+        self.method = method
+
+    def formula(self):
+        return '${0}'.format(self.method)
+
+    def __eq__(self, value):
+        return TallyComparison(self, '=', value)
+
+    def __ne__(self, value):
+        return ~TallyComparison(self, '=', value)
+
+    def __lt__(self, value):
+        return TallyComparison(self, '<', value)
+
+    def __le__(self, value):
+        return TallyComparison(self, '<=', value)
+
+    def __gt__(self, value):
+        return TallyComparison(self, '>', value)
+
+    def __ge__(self, value):
+        return TallyComparison(self, '>=', value)
+
+    __hash__ = None
+
+    def isin(self, values):
+        values = list(values)
+        if not values:
+            raise ValueError("isin requires at least one value")
+        return TallyBooleanPredicate(
+            'OR', *[TallyComparison(self, '=', v) for v in values]
+        )
+
+    def contains(self, value):
+        return TallyComparison(self, 'Contains', value)
+
+    def startswith(self, value):
+        return TallyComparison(self, 'Starting With', value)
+
+    def endswith(self, value):
+        return TallyComparison(self, 'Ending With', value)
+
+
+def compile_filters(where, prefix='TendrilFilter'):
+    """
+    Compile a predicate, or a list of predicates which must all hold, into
+    a dictionary of TDL filter names to formulae.
+    """
+    if where is None:
+        return {}
+    if isinstance(where, TallyPredicate):
+        where = [where]
+    return {'{0}{1}'.format(prefix, idx): predicate.formula()
+            for idx, predicate in enumerate(where)}
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Pooled HTTP Transport for Tally XML Requests
+--------------------------------------------
+
+A single :class:`requests.Session` is shared by all Tally XML requests made
+from this process. Connections to each Tally host are pooled and kept alive
+between requests, and the number of sockets held open to any one host is
+bounded by ``TALLY_POOL_MAXSIZE``. Requests in excess of the pool size wait
+for a connection to be returned to the pool instead of opening new ones.
+
+Streamed responses hold their connection until they are read to the end
+or closed. Streams returned by :meth:`TallyXMLEngine.iterparse` and
+:meth:`TallyReport.stream` release it when they are closed or garbage
+collected, including if they are never iterated. Streams abandoned
+part way should nevertheless be closed explicitly, since a pool
+exhausted by unreleased connections would block every later request.
+
+Requests made concurrently by the connector itself, by the async engine,
+for voucher list shards and for masters collections, are each bounded
+by ``TALLY_MAX_CONCURRENCY``.
+"""
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+try:
+    from tendril.config import TALLY_CONNECT_TIMEOUT
+    from tendril.config import TALLY_READ_TIMEOUT
+    from tendril.config import TALLY_POOL_CONNECTIONS
+    from tendril.config import TALLY_POOL_MAXSIZE
+except ImportError:
+    TALLY_CONNECT_TIMEOUT = 5
+    TALLY_READ_TIMEOUT = 600
+    TALLY_POOL_CONNECTIONS = 2
+    TALLY_POOL_MAXSIZE = 4
+
+try:
+    from tendril.config import TALLY_MAX_CONCURRENCY
+except ImportError:
+    TALLY_MAX_CONCURRENCY = 4
+
+
+def _transport_init():
+    l_session = Session()
+    adapter = HTTPAdapter(pool_connections=TALLY_POOL_CONNECTIONS,
+                          pool_maxsize=TALLY_POOL_MAXSIZE,
+                          pool_block=True)
+    l_session.mount('http://', adapter)
+    l_session.mount('https://', adapter)
+    l_session.headers.update({'Content-Type': 'application/xml',
+                              'Connection': 'keep-alive'})
+    return l_session
+
+
+session = _transport_init()
+timeout = (TALLY_CONNECT_TIMEOUT, TALLY_READ_TIMEOUT)
@@ -24,8 +24,14 @@ Tally Vouchers and Voucher Types
 """
 
 
+import time
+import arrow
+from datetime import date
 from lxml import etree
 from six import iteritems
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.structures import CaseInsensitiveDict
 
 from .utils.converters import TXBoolean
 from .utils.converters import TXString
@@ -33,10 +39,16 @@ from .utils.converters import TXInteger
 from .utils.converters import TXDate
 from .utils.converters import TXDateTime
 from .utils.converters import TXMultilineString
+from .utils.dates import get_date_range
+from .utils.dates import split_date_range
+from .utils.tdl import TallyField
+from .utils.tdl import compile_filters
+from .utils.transport import TALLY_MAX_CONCURRENCY
 
 from . import TallyElement
 from . import TallyReport
 from . import TallyRequestHeader
+from . import TallyNotAvailable
 
 from . import ledgers
 from . import stock
@@ -225,11 +237,12 @@ class TallyVoucher(TallyElement):
 
 
 class TallyVouchersList(TallyReport):
-    _cachename = None
+    _cachename = 'TallyVouchersList'
     _header = TallyRequestHeader(1, 'Export', 'Data', 'Voucher Register')
 
-    def __init__(self, company_name, dt=None, end_dt=None, filters=None):
-        super(TallyVouchersList, self).__init__(company_name)
+    def __init__(self, company_name, dt=None, end_dt=None, filters=None,
+                 **kwargs):
+        super(TallyVouchersList, self).__init__(company_name, **kwargs)
         self._dt = dt
         self._end_dt = end_dt
         self._filters = filters or {}
@@ -250,29 +263,248 @@ class TallyVouchersList(TallyReport):
     }
 
 
+class TallyVouchersCollection(TallyReport):
+    """
+    Vouchers exported as a custom TDL collection of type Voucher, rather
+    than through the Voucher Register report. The fields of
+    :class:`TallyVoucher` (or of its projection) are requested with FETCH,
+    and the collection can be narrowed on the Tally side with TDL filters.
+
+    ``where`` is a predicate or list of predicates built with
+    :mod:`tendril.connectors.tally.utils.tdl`, and ``tdl_filters`` maps
+    filter names to raw TDL formulae. Each is defined as a ``SYSTEM``
+    formula in the request's ``TDLMESSAGE`` and applied to the
+    collection. ``filters`` are as for :class:`TallyVouchersList`, and
+    are applied as equality predicates on the corresponding voucher
+    methods. If ``alterid`` is given, only vouchers with a greater
+    AlterID are returned.
+    """
+    _cachename = 'TallyVouchersCollection'
+    _header = TallyRequestHeader(1, 'Export', 'Collection',
+                                 'Tendril Vouchers')
+
+    def __init__(self, company_name, dt=None, end_dt=None, filters=None,
+                 alterid=None, tdl_filters=None, where=None, **kwargs):
+        super(TallyVouchersCollection, self).__init__(company_name, **kwargs)
+        self._dt = dt
+        self._end_dt = end_dt
+        self._tdl_filters = compile_filters(where)
+        for tag, value in iteritems(filters or {}):
+            self._tdl_filters['TendrilFilter{0}'.format(tag)] = \
+                (TallyField(tag) == value).formula()
+        self._tdl_filters.update(tdl_filters or {})
+        if alterid is not None:
+            self._tdl_filters['TendrilAlteredSince'] = \
+                (TallyField('AlterID') > int(alterid)).formula()
+
+    def _build_request_body(self):
+        r = etree.Element('DESC')
+        sv = etree.SubElement(r, 'STATICVARIABLES')
+        self._set_request_staticvariables(sv)
+        self._set_request_date(sv, dt=self._dt, end_dt=self._end_dt)
+        tdl = etree.SubElement(r, 'TDL')
+        tdlmessage = etree.SubElement(tdl, 'TDLMESSAGE')
+        collection = etree.SubElement(tdlmessage, 'COLLECTION', ISMODIFY='No',
+                                      NAME=self._header.id)
+        colltype = etree.SubElement(collection, 'TYPE')
+        colltype.text = 'Voucher'
+        self._build_fetchlist(collection,
+                              self._build_fetchlist_for('vouchers'))
+        self._build_tdl_filters(tdlmessage, collection, self._tdl_filters)
+        return etree.ElementTree(r)
+
+    _container = 'collection'
+    _content = {
+        'vouchers': ('voucher', TallyVoucher)
+    }
+
+
+class TallyShardedVouchersList(object):
+    """
+    Voucher list for a date range, fetched from Tally as a number of
+    smaller requests, each covering one calendar month or week of the
+    range. Up to ``max_workers`` shards are fetched concurrently, and a
+    shard which fails is retried on its own up to ``retries`` times, after
+    a delay starting at ``retry_delay`` seconds and doubling each time.
+
+    Shards are not created for dates after today. If the range extends
+    beyond today, the last shard runs to the end of the range, so that
+    post-dated vouchers are still included.
+
+    Vouchers are presented in shard order, as a single collection through
+    :attr:`vouchers` or as a stream through :meth:`iter_content` or
+    :meth:`stream`. Other
+    keyword arguments are passed to the report of each shard, which is a
+    :class:`TallyVouchersCollection` if ``where`` is given and a
+    :class:`TallyVouchersList` otherwise.
+    """
+    _content = TallyVouchersList._content
+
+    def __init__(self, company_name, dt=None, end_dt=None, filters=None,
+                 shard='month', max_workers=None, retries=2, retry_delay=1,
+                 **kwargs):
+        self._company_name = company_name
+        self._max_workers = max_workers or TALLY_MAX_CONCURRENCY
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._shards = [
+            get_list(company_name, dt=s, end_dt=e, filters=filters, **kwargs)
+            for s, e in self._split(dt, end_dt, shard)
+        ]
+
+    @staticmethod
+    def _split(dt, end_dt, shard):
+        (start, end), _ = get_date_range(dt, end_dt)
+        today = arrow.get(date.today())
+        if end <= today or start > today:
+            return split_date_range(start, end, shard)
+        shards = split_date_range(start, today, shard)
+        shards[-1] = (shards[-1][0], arrow.get(end).floor('day'))
+        return shards
+
+    @property
+    def company_name(self):
+        return self._company_name
+
+    @property
+    def shards(self):
+        return self._shards
+
+    def _fetch_shard(self, shard):
+        attempt = 0
+        while True:
+            try:
+                return shard.vouchers
+            except TallyNotAvailable:
+                attempt += 1
+                if attempt > self._retries:
+                    raise
+                time.sleep(self._retry_delay * 2 ** (attempt - 1))
+
+    def _iter_shards(self):
+        # At most max_workers shards are in flight or waiting to be
+        # consumed at any time.
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            pending = deque()
+            shards = iter(self._shards)
+            for shard in shards:
+                pending.append((shard, executor.submit(self._fetch_shard,
+                                                       shard)))
+                if len(pending) >= self._max_workers:
+                    break
+            while pending:
+                shard, future = pending.popleft()
+                yield shard, future.result()
+                for shard in shards:
+                    pending.append((shard, executor.submit(self._fetch_shard,
+                                                           shard)))
+                    break
+
+    @property
+    def vouchers(self):
+        if 'vouchers' not in self.__dict__:
+            val = CaseInsensitiveDict()
+            for _, shard_vouchers in self._iter_shards():
+                val.update(shard_vouchers)
+            self.__dict__['vouchers'] = val
+        return self.__dict__['vouchers']
+
+    def iter_content(self, item):
+        if item not in self._content.keys():
+            raise AttributeError(item)
+        if item in self.__dict__:
+            for obj in self.__dict__[item].values():
+                yield obj
+            return
+        for shard, shard_vouchers in self._iter_shards():
+            for obj in shard_vouchers.values():
+                yield obj
+            # Drop each shard once it has been consumed.
+            del shard.__dict__[item]
+            shard.release()
+
+    def stream(self, item):
+        """
+        Generator yielding the objects of the named content collection,
+        one shard at a time. Each shard is streamed from its response as it
+        is parsed, so only one shard is held at a time.
+        """
+        if item not in self._content.keys():
+            raise AttributeError(item)
+        for shard in self._shards:
+            for obj in shard.stream(item):
+                yield obj
+
+    def afetch(self, *content):
+        """
+        Return an awaitable which acquires the named content collections,
+        or all of them, without blocking the event loop. The awaitable
+        resolves to the sharded list itself.
+
+        Requires Python 3.5 or newer. See :mod:`tendril.connectors.tally.aio`.
+        """
+        from .aio import fetch
+        return fetch(self, *content)
+
+    def release(self):
+        """
+        Release the combined collection and the responses of all shards.
+        """
+        self.__dict__.pop('vouchers', None)
+        for shard in self._shards:
+            shard.__dict__.pop('vouchers', None)
+            shard.release()
+
+
 def get_list(*args, **kwargs):
+    """
+    Return the list of vouchers for the company and date range.
+
+    If ``shard`` is given as 'month' or 'week', the range is fetched in
+    shards by a :class:`TallyShardedVouchersList`, which also accepts
+    ``max_workers`` and ``retries``.
+
+    If ``where`` is given, vouchers are filtered on the Tally side and
+    fetched as a :class:`TallyVouchersCollection`.
+    """
+    if kwargs.get('shard'):
+        return TallyShardedVouchersList(*args, **kwargs)
+    kwargs.pop('shard', None)
+    if kwargs.get('where') is not None:
+        return TallyVouchersCollection(*args, **kwargs)
+    kwargs.pop('where', None)
     return TallyVouchersList(*args, **kwargs)
 
 
+def iter_list(*args, **kwargs):
+    """
+    Generator yielding the vouchers selected by the arguments, which are as
+    for :func:`get_list`, one at a time as the response is parsed. Vouchers
+    are not retained, so memory use is bounded regardless of the size of
+    the date range.
+    """
+    return get_list(*args, **kwargs).iter_content('vouchers')
+
+
 def get_list_sales(*args, **kwargs):
     filters = kwargs.pop('filters', {})
     filters['VoucherTypeName'] = 'Sales'
-    return TallyVouchersList(*args, filters=filters, **kwargs)
+    return get_list(*args, filters=filters, **kwargs)
 
 
 def get_list_proforma_invoice(*args, **kwargs):
     filters = kwargs.pop('filters', {})
     filters['VoucherTypeName'] = 'Performa Invoice'
-    return TallyVouchersList(*args, filters=filters, **kwargs)
+    return get_list(*args, filters=filters, **kwargs)
 
 
 def get_list_stock_journal(*args, **kwargs):
     filters = kwargs.pop('filters', {})
     filters['VoucherTypeName'] = 'Stock Journal'
-    return TallyVouchersList(*args, filters=filters, **kwargs)
+    return get_list(*args, filters=filters, **kwargs)
 
 
 def get_list_manufacturing_journal(*args, **kwargs):
     filters = kwargs.pop('filters', {})
     filters['VoucherTypeName'] = 'Manufacturing Journal'
-    return TallyVouchersList(*args, filters=filters, **kwargs)
+    return get_list(*args, filters=filters, **kwargs)
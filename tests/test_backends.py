@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+The bs4 and lxml parser backends are expected to produce identical
+collections from the same response.
+"""
+
+import pytest
+from six import BytesIO
+
+from tendril.connectors.tally import TallyRecord
+from tendril.connectors.tally import TallyXMLEngine
+from tendril.connectors.tally.masters import TallyMasters
+
+
+MASTERS = b"""<ENVELOPE>
+<HEADER><TALLYREQUEST>Import Data</TALLYREQUEST></HEADER>
+<BODY><IMPORTDATA>
+<REQUESTDESC><REPORTNAME>All Masters</REPORTNAME></REQUESTDESC>
+<REQUESTDATA>
+<TALLYMESSAGE xmlns:UDF="TallyUDF">
+<STOCKGROUP NAME="Components" RESERVEDNAME="">
+<PARENT></PARENT>
+<COSTINGMETHOD>Avg. Cost</COSTINGMETHOD>
+<VALUATIONMETHOD>Avg. Price</VALUATIONMETHOD>
+<NARRATION/>
+<BASEUNITS>nos</BASEUNITS>
+<ADDITIONALUNITS>&#4; Not Applicable</ADDITIONALUNITS>
+<ISADDABLE>Yes</ISADDABLE>
+<ISBATCHWISEON>No</ISBATCHWISEON>
+<ISPERISHABLEON>No</ISPERISHABLEON>
+<IGNOREPHYSICALDIFFERENCE>No</IGNOREPHYSICALDIFFERENCE>
+<IGNORENEGATIVESTOCK>No</IGNORENEGATIVESTOCK>
+<TREATSALESASMANUFACTURED>No</TREATSALESASMANUFACTURED>
+<TREATPURCHASESASCONSUMED>No</TREATPURCHASESASCONSUMED>
+<TREATREJECTSASSCRAP>No</TREATREJECTSASSCRAP>
+<HASMFGDATE>No</HASMFGDATE>
+<ALLOWUSEOFEXPIREDITEMS>No</ALLOWUSEOFEXPIREDITEMS>
+<IGNOREBATCHES>No</IGNOREBATCHES>
+<IGNOREGODOWNS>No</IGNOREGODOWNS>
+<LANGUAGENAME.LIST><NAME.LIST TYPE="String">
+<NAME>Components</NAME></NAME.LIST></LANGUAGENAME.LIST>
+</STOCKGROUP>
+</TALLYMESSAGE>
+<TALLYMESSAGE xmlns:UDF="TallyUDF">
+<STOCKITEM NAME="Resistor 10K &amp; 1%" RESERVEDNAME="">
+<PARENT>Components</PARENT>
+<CATEGORY>&#4; Not Applicable</CATEGORY>
+<NARRATION/>
+<COSTINGMETHOD>FIFO</COSTINGMETHOD>
+<VALUATIONMETHOD>Avg. Price</VALUATIONMETHOD>
+<BASEUNITS>nos</BASEUNITS>
+<ADDITIONALUNITS>&#4; Not Applicable</ADDITIONALUNITS>
+<DESCRIPTION>Resistor, 10K &lt;1/4W&gt;</DESCRIPTION>
+<ISBATCHWISEON>No</ISBATCHWISEON>
+<ISPERISHABLEON>Yes</ISPERISHABLEON>
+<IGNOREPHYSICALDIFFERENCE>No</IGNOREPHYSICALDIFFERENCE>
+<IGNORENEGATIVESTOCK>No</IGNORENEGATIVESTOCK>
+<TREATSALESASMANUFACTURED>No</TREATSALESASMANUFACTURED>
+<TREATPURCHASESASCONSUMED>No</TREATPURCHASESASCONSUMED>
+<TREATREJECTSASSCRAP>No</TREATREJECTSASSCRAP>
+<HASMFGDATE>No</HASMFGDATE>
+<ALLOWUSEOFEXPIREDITEMS>No</ALLOWUSEOFEXPIREDITEMS>
+<IGNOREBATCHES>No</IGNOREBATCHES>
+<IGNOREGODOWNS>No</IGNOREGODOWNS>
+<EXCLUDEJRNLFORVALUATION>No</EXCLUDEJRNLFORVALUATION>
+<OPENINGBALANCE> 1200 nos</OPENINGBALANCE>
+<OPENINGVALUE>-240.00</OPENINGVALUE>
+<OPENINGRATE>0.20/nos</OPENINGRATE>
+<LANGUAGENAME.LIST><NAME.LIST TYPE="String">
+<NAME>Resistor 10K &amp; 1%</NAME><NAME>RES-10K</NAME>
+</NAME.LIST></LANGUAGENAME.LIST>
+<BATCHALLOCATIONS.LIST>
+<GODOWNNAME>Main Location</GODOWNNAME>
+</BATCHALLOCATIONS.LIST>
+</STOCKITEM>
+</TALLYMESSAGE>
+<TALLYMESSAGE xmlns:UDF="TallyUDF">
+<UNIT NAME="nos" RESERVEDNAME="">
+<NAME>nos</NAME>
+<ORIGINALNAME>Numbers</ORIGINALNAME>
+<DECIMALPLACES> 0</DECIMALPLACES>
+<ISSIMPLEUNIT>Yes</ISSIMPLEUNIT>
+<CONVERSION>1.5</CONVERSION>
+</UNIT>
+</TALLYMESSAGE>
+<TALLYMESSAGE xmlns:UDF="TallyUDF">
+<CURRENCY NAME="$" RESERVEDNAME="">
+<MAILINGNAME>USD</MAILINGNAME>
+<EXPANDEDSYMBOL>US Dollars</EXPANDEDSYMBOL>
+<ISSUFFIX>No</ISSUFFIX>
+<DECIMALPLACES> 2</DECIMALPLACES>
+<DAILYSTDRATES.LIST>
+<DATE>20190401</DATE><SPECIFIEDRATE>69.15</SPECIFIEDRATE>
+</DAILYSTDRATES.LIST>
+<DAILYSTDRATES.LIST>
+<DATE>20190402</DATE><SPECIFIEDRATE>69.30</SPECIFIEDRATE>
+</DAILYSTDRATES.LIST>
+</CURRENCY>
+</TALLYMESSAGE>
+</REQUESTDATA>
+</IMPORTDATA></BODY>
+</ENVELOPE>"""
+
+
+def _value(value):
+    # Records are compared by their fields, recursively.
+    if isinstance(value, TallyRecord):
+        return type(value).__name__, tuple(_value(x)
+                                           for x in value.__getstate__())
+    if isinstance(value, (list, tuple)):
+        return tuple(_value(x) for x in value)
+    return value
+
+
+def _masters(backend, **kwargs):
+    report = TallyMasters('Test Company', backend=backend, **kwargs)
+    report._soup = report.backend.parse(MASTERS)
+    return report
+
+
+def _collections(report):
+    return dict(
+        (item, dict((name, _value(obj.to_record()
+                                  if not report.compact else obj))
+                    for name, obj in getattr(report, item).items()))
+        for item in report._content.keys()
+    )
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'compact': True}, {'lazy': True},
+                                    {'fields': ['name', 'parent']}])
+def test_backend_parity(kwargs):
+    bs4 = _collections(_masters('bs4', **kwargs))
+    lxml = _collections(_masters('lxml', **kwargs))
+    assert bs4 == lxml
+    assert len(lxml['stockitems']) == 1
+    assert len(lxml['currencies']) == 1
+
+
+@pytest.mark.parametrize('item', ['stockitems', 'currencies'])
+def test_backend_parity_stream(item):
+    report = TallyMasters('Test Company', backend='lxml')
+
+    def _stream_elements(tag):
+        return TallyXMLEngine().iterparse_source(BytesIO(MASTERS), tag)
+    report._stream_elements = _stream_elements
+    streamed = dict((x.name, _value(x.to_record()))
+                    for x in report.stream(item))
+    assert streamed == _collections(_masters('bs4'))[item]
+
+
+@pytest.mark.parametrize('backend', ['bs4', 'lxml'])
+def test_childless_response_is_retained(backend):
+    report = TallyMasters('Test Company', backend=backend)
+    report._soup = report.backend.parse(b'<ENVELOPE></ENVELOPE>')
+
+    def _requery():
+        raise AssertionError("Response was acquired again")
+    report._acquire_raw_response = _requery
+    assert report.soup is not None
+    assert len(report.units) == 0
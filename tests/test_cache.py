@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Cache entries are read back as written with any codec, and pickled
+entries are authenticated and are not written or read at all without a
+configured key.
+"""
+
+import os
+import gzip
+import zlib
+import pytest
+from six import BytesIO
+
+from tendril.connectors.tally import sync
+from tendril.connectors.tally.utils import cache
+from tendril.connectors.tally.utils import cachemanager
+from tendril.connectors.tally.masters import TallyMasters
+
+
+class _File(BytesIO):
+    def __init__(self, fs, path, content=b''):
+        BytesIO.__init__(self, content)
+        self._fs = fs
+        self._path = path
+
+    def close(self):
+        if self._fs is not None:
+            self._fs.files[self._path] = self.getvalue()
+        BytesIO.close(self)
+
+
+class _FS(object):
+    # An in-memory stand in for the cache filesystem.
+    def __init__(self):
+        self.files = {}
+
+    def open(self, path, mode='rb'):
+        if 'w' in mode:
+            return _File(self, path)
+        return _File(None, path, self.files[path])
+
+
+@pytest.fixture
+def cachefs(monkeypatch):
+    fs = _FS()
+    monkeypatch.setattr(cache, 'cachefs', fs)
+    monkeypatch.setattr(cachemanager, 'manager', None)
+    return fs
+
+
+CODECS = [None, 'gzip', 'zlib']
+if cache.lzma is not None:
+    CODECS.append('lzma')
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_compression_round_trip(cachefs, codec):
+    content = b'<ENVELOPE>' + os.urandom(4096) + b'</ENVELOPE>' * 100
+    with cache.cache_create('entry', codec) as f:
+        f.write(content[:1000])
+        f.write(content[1000:])
+    assert cachefs.files['entry'].startswith(cache._HEADER)
+    with cache.cache_open('entry') as f:
+        assert f.read() == content
+    with cache.cache_open('entry') as f:
+        assert f.read(3) + f.read(2000) + f.read() == content
+
+
+@pytest.mark.parametrize('magic', [b'\x1f\x8b', b'\x78\x01', b'\x78\x5e',
+                                   b'\x78\x9c', b'\x78\xda'])
+def test_uncompressed_entry_with_magic_prefix(cachefs, magic):
+    # The HMAC digest leading an uncompressed pickled entry can begin with
+    # the magic bytes of a codec.
+    content = magic + os.urandom(30) + b'payload'
+    with cache.cache_create('entry', None) as f:
+        f.write(content)
+    with cache.cache_open('entry') as f:
+        assert f.read() == content
+
+
+@pytest.mark.parametrize('codec, compress', [
+    (None, lambda x: x),
+    ('gzip', gzip.compress if hasattr(gzip, 'compress') else None),
+    ('zlib', zlib.compress),
+])
+def test_legacy_entries(cachefs, codec, compress):
+    # Entries written without the header are recognised by their magic.
+    if compress is None:
+        pytest.skip("gzip.compress is not available")
+    content = b'<ENVELOPE></ENVELOPE>' * 100
+    cachefs.files['entry'] = compress(content)
+    with cache.cache_open('entry') as f:
+        assert f.read() == content
+
+
+def test_unknown_codec(cachefs):
+    with pytest.raises(ValueError):
+        cache.cache_create('entry', 'bzip2')
+    cachefs.files['entry'] = cache._HEADER + b'?data'
+    with pytest.raises(ValueError):
+        cache.cache_open('entry')
+
+
+@pytest.fixture
+def key(monkeypatch):
+    monkeypatch.setattr(cache, 'TALLY_CACHE_KEY', 'secret')
+    monkeypatch.setattr(cache, '_key', cache._cache_key())
+
+
+@pytest.fixture
+def nokey(monkeypatch):
+    monkeypatch.setattr(cache, 'TALLY_CACHE_KEY', None)
+    monkeypatch.setattr(cache, '_key_reported', False)
+
+
+def test_hmac_round_trip(key):
+    obj = {'vouchers': [1, 2, 3], 'alterids': {'2019-04-01:': 42}}
+    content = cache.cache_dumps(obj)
+    assert cache.cache_loads(content) == obj
+
+
+def test_hmac_rejects_tampered_entry(key):
+    content = bytearray(cache.cache_dumps({'alterid': 42}))
+    content[-2] ^= 0x01
+    with pytest.raises(ValueError):
+        cache.cache_loads(bytes(content))
+
+
+def test_hmac_rejects_other_key(key, monkeypatch):
+    content = cache.cache_dumps({'alterid': 42})
+    monkeypatch.setattr(cache, '_key', b'another secret')
+    with pytest.raises(ValueError):
+        cache.cache_loads(content)
+
+
+def test_pickles_with_key(key):
+    assert cache.cache_pickles()
+
+
+def test_no_pickles_without_key(nokey, monkeypatch, capsys):
+    assert not cache.cache_pickles()
+    assert not cache.cache_pickles()
+    assert capsys.readouterr().out.count('TALLY_CACHE_KEY') == 1
+
+    def _refuse(*args, **kwargs):
+        raise AssertionError("Pickled cache entry was accessed")
+    monkeypatch.setattr(sync, 'cachefs', object())
+    monkeypatch.setattr(sync, 'cache_open', _refuse)
+    monkeypatch.setattr(sync, 'cache_write', _refuse)
+    store = sync.TallyVoucherStore('Test Company')
+    store.save()
+
+    report = TallyMasters('Test Company')
+    report._read_parsed = _refuse
+    assert report._load_parsed(['units']) is False
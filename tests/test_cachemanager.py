@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+The cache index tracks entries written and accessed by several
+processes, and evicts entries within the budget while keeping those
+which belong together.
+"""
+
+import pytest
+from six import BytesIO
+
+from tendril.connectors.tally.utils.cachemanager import TallyCacheManager
+
+
+class _File(BytesIO):
+    def __init__(self, fs, path, content=b''):
+        BytesIO.__init__(self, content)
+        self._fs = fs
+        self._path = path
+
+    def close(self):
+        if self._fs is not None:
+            self._fs.files[self._path] = self.getvalue()
+        BytesIO.close(self)
+
+
+class _FS(object):
+    # An in-memory stand in for the cache filesystem, counting listings.
+    def __init__(self):
+        self.files = {}
+        self.listings = 0
+
+    def open(self, path, mode='rb'):
+        if 'w' in mode:
+            return _File(self, path)
+        return _File(None, path, self.files[path])
+
+    def write(self, path, size):
+        self.files[path] = b'x' * size
+
+    def listdir(self, files_only=False):
+        self.listings += 1
+        return list(self.files.keys())
+
+    def getinfo(self, path):
+        return {'size': len(self.files[path])}
+
+    def exists(self, path):
+        return path in self.files
+
+    def remove(self, path):
+        del self.files[path]
+
+    def rename(self, src, dst):
+        self.files[dst] = self.files.pop(src)
+
+
+@pytest.fixture
+def fs():
+    return _FS()
+
+
+def _write(manager, path, size):
+    manager._fs.write(path, size)
+    manager.record_write(path, size)
+
+
+def test_writes_are_batched(fs):
+    manager = TallyCacheManager(fs)
+    for idx in range(manager._sync_interval - 1):
+        _write(manager, 'R.Co.{0}.xml'.format(idx), 10)
+    assert fs.listings == 1
+    assert manager._index_path not in fs.files
+    _write(manager, 'R.Co.last.xml', 10)
+    assert manager._index_path in fs.files
+    manager.save()
+    assert fs.listings == 1
+
+
+def test_evict_keeps_sources_and_removes_companions(fs):
+    manager = TallyCacheManager(fs)
+    _write(manager, 'R.Co.a.xml', 40)
+    _write(manager, 'R.Co.a.pickle', 20)
+    _write(manager, 'R.Co.b.xml', 30)
+    _write(manager, 'R.Co.b.pickle', 10)
+    _write(manager, 'R.Co.c.xml', 10)
+    manager.index['entries']['R.Co.a.xml']['atime'] = 1
+    manager.index['entries']['R.Co.a.pickle']['atime'] = 5
+    manager.index['entries']['R.Co.b.xml']['atime'] = 2
+    manager.index['entries']['R.Co.b.pickle']['atime'] = 6
+    manager.index['entries']['R.Co.c.xml']['atime'] = 3
+
+    # The XML a kept pickle was built from is kept with it. Evicting the
+    # XML of b takes its pickle along.
+    removed = manager.evict(max_size=80, keep=('R.Co.a.pickle',))
+    assert sorted(removed) == ['R.Co.b.pickle', 'R.Co.b.xml']
+    assert sorted(manager.index['entries'].keys()) == \
+        ['R.Co.a.pickle', 'R.Co.a.xml', 'R.Co.c.xml']
+    assert 'R.Co.b.xml' not in fs.files
+
+    removed = manager.evict(max_size=0, keep=('R.Co.c.xml',))
+    assert sorted(removed) == ['R.Co.a.pickle', 'R.Co.a.xml']
+    assert list(manager.index['entries'].keys()) == ['R.Co.c.xml']
+
+
+def test_concurrent_index_deltas_merged(fs):
+    _write(TallyCacheManager(fs), 'R.Co.shared.xml', 10)
+    fs.write('R.Co.gone.xml', 10)
+    first = TallyCacheManager(fs)
+    second = TallyCacheManager(fs)
+    first.index
+    second.index
+    first.save()
+    second.save()
+
+    first.record_hit('R.Co.shared.xml')
+    first.record_miss('R.Co.new1.xml')
+    _write(first, 'R.Co.new1.xml', 10)
+    second.record_hit('R.Co.shared.xml')
+    second.record_hit('R.Co.shared.xml')
+    second.record_miss('R.Co.new2.xml')
+    _write(second, 'R.Co.new2.xml', 10)
+    assert second._remove('R.Co.gone.xml')
+
+    first.save()
+    second.save()
+    first.save()
+    for manager in (first, second):
+        index = manager.index
+        assert sorted(index['entries'].keys()) == \
+            ['R.Co.new1.xml', 'R.Co.new2.xml', 'R.Co.shared.xml']
+        assert index['entries']['R.Co.shared.xml']['hits'] == 3
+        assert index['hits'] == 3
+        assert index['misses'] == 2
+
+
+def test_purge_picks_up_unindexed_entries(fs):
+    manager = TallyCacheManager(fs)
+    _write(manager, 'R.Co.a.xml', 10)
+    manager.save()
+    fs.write('R.Other.b.xml', 10)
+    assert manager.purge(company='Other') == ['R.Other.b.xml']
+    assert list(manager.index['entries'].keys()) == ['R.Co.a.xml']
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+The converter fast paths are expected to give the same results, and fail
+on the same inputs, as the general parsing they replace.
+"""
+
+import arrow
+import pytest
+from decimal import Decimal
+
+from tendril.connectors.tally.utils import converters
+from tendril.connectors.tally.utils.converters import TXDate
+from tendril.connectors.tally.utils.converters import TXDateTime
+from tendril.connectors.tally.utils.converters import TXDecimal
+from tendril.connectors.tally.utils.converters import TXBoolean
+
+
+def _baseline_decimal(soup):
+    return Decimal(soup)
+
+
+def _baseline_boolean(soup):
+    if soup == 'Yes':
+        return True
+    elif soup == 'No':
+        return False
+    raise ValueError
+
+
+def _baseline_date(soup):
+    return arrow.get(soup, 'YYYYMMDD')
+
+
+def _baseline_datetime(soup):
+    return arrow.get(' '.join([x.strip() for x in soup.split('at')]),
+                     'D-MMM-YYYY HH:mm')
+
+
+def _baseline(convert, required):
+    def _from_tallyxml(soup):
+        if not soup.strip():
+            if not required:
+                return None
+            raise ValueError
+        return convert(soup.strip())
+    return _from_tallyxml
+
+
+def _outcome(func, soup):
+    try:
+        value = func(soup)
+    except ValueError:
+        return 'ValueError'
+    except ArithmeticError:
+        return 'ArithmeticError'
+    if isinstance(value, arrow.Arrow):
+        return value.isoformat()
+    return repr(value)
+
+
+CASES = [
+    (TXDecimal, _baseline_decimal,
+     ['', '   ', '0', '-0', '-240.00', ' -1200.50 ', '\n12.5\n', '1e3',
+      '1,200.00', 'abc', '- 1']),
+    (TXBoolean, _baseline_boolean,
+     ['', ' ', 'Yes', 'No', 'yes', 'no', 'YES', ' Yes ', 'No\n', 'True']),
+    (TXDate, _baseline_date,
+     ['', ' ', '20190401', ' 20190401 ', '20200229', '20190229', '20191301',
+      '2019041', '2019-04-01', '1-Apr-2019 at 10:05']),
+    (TXDateTime, _baseline_datetime,
+     ['', ' ', '1-Apr-2019 at 10:05', '01-apr-2019 at 23:59',
+      ' 31-Dec-2019  at  00:00 ', '1-Apr-2019', '20190401',
+      '31-Feb-2019 at 10:05', '1-Foo-2019 at 10:05']),
+]
+
+
+@pytest.mark.parametrize('required', [False, True])
+@pytest.mark.parametrize('cls,baseline,values', CASES,
+                         ids=[c[0].__name__ for c in CASES])
+def test_fast_path_equivalence(cls, baseline, values, required):
+    converter = cls(required=required)
+    reference = _baseline(baseline, required)
+    for soup in values:
+        # Twice, so that memoized values are compared as well.
+        for _ in range(2):
+            assert _outcome(converter.from_tallyxml, soup) == \
+                _outcome(reference, soup), soup
+
+
+def test_lru_memo_bound():
+    memo = converters._LRUMemo(maxsize=3)
+    for key in 'abc':
+        memo.store(key, key.upper())
+    assert memo.lookup('a') == 'A'
+    memo.store('d', 'D')
+    assert len(memo) == 3
+    with pytest.raises(KeyError):
+        memo.lookup('b')
+    assert [memo.lookup(k) for k in 'acd'] == ['A', 'C', 'D']
+
+
+def test_date_memo_is_bounded(monkeypatch):
+    monkeypatch.setattr(TXDate, '_memo', converters._LRUMemo(maxsize=8))
+    converter = TXDate()
+    first = converter.from_tallyxml('20190401')
+    for day in range(1, 29):
+        converter.from_tallyxml('201902{0:02d}'.format(day))
+    assert len(TXDate._memo) == 8
+    assert converter.from_tallyxml('20190228') is \
+        converter.from_tallyxml('20190228')
+    assert converter.from_tallyxml('20190401') == first
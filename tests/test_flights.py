@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Identical requests made concurrently from several threads share a single
+round trip to Tally.
+"""
+
+import time
+import threading
+
+import pytest
+from requests.exceptions import ConnectionError
+
+from tendril.connectors.tally import TallyXMLEngine
+from tendril.connectors.tally import TallyNotAvailable
+from tendril.connectors.tally import _flights
+from tendril.connectors.tally.masters import TallyMasters
+from tendril.connectors.tally.utils import transport
+
+
+RESPONSE = b'<ENVELOPE><UNIT NAME="nos"><NAME>nos</NAME></UNIT></ENVELOPE>'
+
+
+class _Response(object):
+    content = RESPONSE
+
+
+class _Transport(object):
+    # Stands in for the session, holding each request until released.
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.requests = 0
+        self.received = threading.Event()
+        self.release = threading.Event()
+
+    def post(self, uri, data=None, **kwargs):
+        self.requests += 1
+        self.received.set()
+        self.release.wait(5)
+        if self.fail:
+            raise ConnectionError("Tally is not running")
+        return _Response()
+
+
+@pytest.fixture
+def session(monkeypatch):
+    def _session(fail=False):
+        fake = _Transport(fail)
+        monkeypatch.setattr(transport.session, 'post', fake.post)
+        return fake
+    return _session
+
+
+def _execute_concurrently(count):
+    query = TallyMasters('Test Company')._build_query()
+    results = [None] * count
+
+    def _execute(idx):
+        try:
+            results[idx] = TallyXMLEngine().execute(query, backend='lxml')
+        except Exception as e:
+            results[idx] = e
+
+    threads = [threading.Thread(target=_execute, args=(idx,))
+               for idx in range(count)]
+    for thread in threads:
+        thread.start()
+    return query, threads, results
+
+
+def _wait(threads):
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads)
+
+
+def test_concurrent_requests_coalesced(session):
+    fake = session()
+    _, threads, results = _execute_concurrently(8)
+    assert fake.received.wait(5)
+    # Let the other threads find the request in flight.
+    time.sleep(0.2)
+    fake.release.set()
+    _wait(threads)
+    assert fake.requests == 1
+    assert results[0] is not None
+    assert all(x is results[0] for x in results)
+    assert not _flights
+
+
+def test_failed_flight_cleared(session):
+    fake = session(fail=True)
+    query, threads, results = _execute_concurrently(4)
+    assert fake.received.wait(5)
+    time.sleep(0.2)
+    fake.release.set()
+    _wait(threads)
+    assert fake.requests == 1
+    assert all(isinstance(x, TallyNotAvailable) for x in results)
+    assert not _flights
+
+    fake = session()
+    fake.release.set()
+    assert TallyXMLEngine().execute(query, backend='lxml') is not None
+    assert fake.requests == 1
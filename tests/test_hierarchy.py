@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Hierarchy and reverse indexes over the masters, built from the same
+response as the backend parity tests with further stock groups and
+items added.
+"""
+
+import re
+
+import pytest
+
+from tendril.connectors.tally.masters import TallyMasters
+
+from .test_backends import MASTERS
+
+
+_component_group = re.search(b'<STOCKGROUP NAME="Components".*?</STOCKGROUP>',
+                             MASTERS, re.DOTALL).group(0)
+
+
+def _group(name, parent, costing=''):
+    group = _component_group.replace(b'"Components"',
+                                     '"{0}"'.format(name).encode())
+    group = group.replace(b'<NAME>Components</NAME>',
+                          '<NAME>{0}</NAME>'.format(name).encode())
+    group = group.replace(b'<PARENT></PARENT>',
+                          '<PARENT>{0}</PARENT>'.format(parent).encode())
+    group = group.replace(b'Avg. Cost', costing.encode())
+    return b'<TALLYMESSAGE>' + group + b'</TALLYMESSAGE>'
+
+
+def _item(name, parent, godown):
+    item = re.search(b'<STOCKITEM .*?</STOCKITEM>', MASTERS,
+                     re.DOTALL).group(0)
+    item = item.replace(b'Resistor 10K &amp; 1%', name.encode())
+    item = item.replace(b'<PARENT>Components</PARENT>',
+                        '<PARENT>{0}</PARENT>'.format(parent).encode())
+    item = item.replace(b'Main Location', godown.encode())
+    item = item.replace(b'<BASEUNITS>nos</BASEUNITS>',
+                        b'<BASEUNITS>pcs</BASEUNITS>')
+    return b'<TALLYMESSAGE>' + item + b'</TALLYMESSAGE>'
+
+
+# Components
+#   Passives
+#     Capacitors
+#       Capacitor 1uF
+#   Resistor 10K & 1%
+# Loop A <-> Loop B
+# Orphan -> (missing)
+HIERARCHY = MASTERS.replace(b'</REQUESTDATA>', b''.join([
+    _group('Passives', 'Components'),
+    _group('Capacitors', 'Passives'),
+    _group('Loop A', 'Loop B', 'FIFO'),
+    _group('Loop B', 'Loop A'),
+    _group('Orphan', 'Missing'),
+    _item('Capacitor 1uF', 'Capacitors', 'Stores'),
+]) + b'</REQUESTDATA>')
+
+
+@pytest.fixture(params=['bs4', 'lxml'])
+def masters(request):
+    report = TallyMasters('Test Company', backend=request.param)
+    report._soup = report.backend.parse(HIERARCHY)
+    return report
+
+
+def _names(objs):
+    return sorted(x.name for x in objs)
+
+
+def test_roots(masters):
+    hierarchy = masters.stockgroup_hierarchy
+    assert sorted(hierarchy.roots) == ['Components', 'Orphan']
+
+
+def test_path(masters):
+    hierarchy = masters.stockgroup_hierarchy
+    assert hierarchy.path('Components') == ('Components',)
+    assert hierarchy.path('capacitors') == \
+        ('Components', 'Passives', 'Capacitors')
+    assert hierarchy.depth('Capacitors') == 2
+    assert hierarchy.parent('Capacitors') == 'Passives'
+    assert hierarchy.parent('Components') is None
+    with pytest.raises(KeyError):
+        hierarchy.path('Inductors')
+
+
+def test_ancestors(masters):
+    hierarchy = masters.stockgroup_hierarchy
+    assert hierarchy.ancestors('Capacitors') == \
+        frozenset(['Components', 'Passives'])
+    assert hierarchy.ancestors('Components') == frozenset()
+
+
+def test_descendants(masters):
+    hierarchy = masters.stockgroup_hierarchy
+    assert hierarchy.descendants('Components') == ('Passives', 'Capacitors')
+    assert hierarchy.children('Components') == ['Passives']
+    assert hierarchy.descendants('Capacitors') == ()
+
+
+def test_leaves(masters):
+    hierarchy = masters.stockgroup_hierarchy
+    assert _names(hierarchy.leaves('Components')) == \
+        ['Capacitor 1uF', 'Resistor 10K & 1%']
+    assert _names(hierarchy.leaves('Components', recursive=False)) == \
+        ['Resistor 10K & 1%']
+    assert _names(masters.items_under_group('Passives')) == \
+        ['Capacitor 1uF']
+
+
+def test_inherited(masters):
+    hierarchy = masters.stockgroup_hierarchy
+    assert hierarchy.inherited('Capacitors', 'costingmethod') is None
+    assert hierarchy.inherited('Capacitors', 'costingmethod',
+                               recursive=True) == 'Avg. Cost'
+    assert hierarchy.inherited('Loop B', 'costingmethod',
+                               recursive=True) == 'FIFO'
+    assert hierarchy.inherited('Orphan', 'costingmethod',
+                               recursive=True) is None
+
+
+def test_cycle(masters):
+    hierarchy = masters.stockgroup_hierarchy
+    assert hierarchy.path('Loop A') == ('Loop B', 'Loop A')
+    assert hierarchy.path('Loop B') == ('Loop A', 'Loop B')
+    assert hierarchy.ancestors('Loop A') == frozenset(['Loop B'])
+    assert hierarchy.descendants('Loop A') == ('Loop B',)
+    assert hierarchy.descendants('Loop B') == ('Loop A',)
+
+
+def test_orphan(masters):
+    hierarchy = masters.stockgroup_hierarchy
+    assert hierarchy.parent('Orphan') == 'Missing'
+    assert hierarchy.path('Orphan') == ('Orphan',)
+    assert hierarchy.depth('Orphan') == 0
+    assert hierarchy.descendants('Missing') == ()
+    assert hierarchy.leaves('Missing') == []
+
+
+def test_reverse_index_contents(masters):
+    assert _names(masters.items_in_group('Components')) == \
+        ['Resistor 10K & 1%']
+    assert _names(masters.items_in_group('Capacitors')) == ['Capacitor 1uF']
+    assert masters.items_in_group('Passives') == ()
+    assert _names(masters.items_in_godown('Main Location')) == \
+        ['Resistor 10K & 1%']
+    assert _names(masters.items_in_godown('Stores')) == ['Capacitor 1uF']
+    assert _names(masters.items_by_unit('nos')) == ['Resistor 10K & 1%']
+    assert _names(masters.items_by_unit('pcs')) == ['Capacitor 1uF']
+    assert masters.items_by_ledger('Sales') == ()
+    assert masters.vouchertypes_by_parent('Sales') == ()
+
+
+def test_reverse_index_lookup(masters):
+    assert masters.items_in_group('COMPONENTS') == \
+        masters.items_in_group('components')
+    assert isinstance(masters.items_in_group('Components'), tuple)
+    assert masters.items_in_group('Inductors') == ()
+    assert masters.items_in_group('') == ()
+    assert masters.items_in_group(None) == ()
+    # The stock items in the index are those of the collection.
+    item = masters.items_in_group('Components')[0]
+    assert item is masters.stockitems['Resistor 10K & 1%']
+
+
+def test_reverse_index_rebuilt_on_refresh(masters):
+    index = masters._build_reverse_index(
+        '_items_by_group', 'stockitems', masters._field_keys('_parent')
+    )
+    assert masters._build_reverse_index(
+        '_items_by_group', 'stockitems', masters._field_keys('_parent')
+    ) is index
+    masters.refresh()
+    masters._soup = masters.backend.parse(HIERARCHY.replace(
+        b'<PARENT>Capacitors</PARENT>', b'<PARENT>Passives</PARENT>'
+    ))
+    assert masters.items_in_group('Capacitors') == ()
+    assert _names(masters.items_in_group('Passives')) == ['Capacitor 1uF']
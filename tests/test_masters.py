@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Masters fetched in the collections mode request each collection on its
+own, concurrently, and retry collections whose request failed.
+"""
+
+import sys
+import threading
+
+import pytest
+
+from tendril.connectors.tally import TallyNotAvailable
+from tendril.connectors.tally import masters
+
+from .test_backends import MASTERS
+from .test_backends import _collections
+from .test_backends import _masters as _all_masters
+
+
+class _Collections(object):
+    # Serves each collection from the masters fixture, recording the
+    # collections requested and failing those listed in failures.
+    def __init__(self):
+        self.requests = []
+        self.failures = []
+        self.lock = threading.Lock()
+
+    def report(self, company_name, item, **kwargs):
+        with self.lock:
+            self.requests.append((item, kwargs))
+            if item in self.failures:
+                self.failures.remove(item)
+                raise TallyNotAvailable
+        report = masters.TallyMasters(company_name, fetch_mode='all')
+        report._soup = report.backend.parse(MASTERS)
+        return report
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    fake = _Collections()
+
+    def _collection_report(self, item, **kwargs):
+        return fake.report(self.company_name, item, **kwargs)
+    monkeypatch.setattr(masters.TallyMasters, '_collection_report',
+                        _collection_report)
+    return fake
+
+
+def _masters():
+    return masters.TallyMasters('Test Company', fetch_mode='collections')
+
+
+def test_collections_fetched_individually(collections):
+    report = _masters()
+    assert list(report.units.keys()) == ['nos']
+    assert report.units is report.units
+    assert collections.requests == [('units', {})]
+
+
+def test_prefetch(collections):
+    report = _masters()
+    report.prefetch()
+    assert _collections(report) == _collections(_all_masters('lxml'))
+    assert sorted(x[0] for x in collections.requests) == \
+        sorted(report._content.keys())
+    assert report.stockgroup_hierarchy.roots == ['Components']
+
+
+def test_failed_collection_retried(collections):
+    collections.failures = ['units']
+    report = _masters()
+    with pytest.raises(TallyNotAvailable):
+        report.units
+    assert 'units' not in report._collection_futures
+    assert list(report.units.keys()) == ['nos']
+    assert [x[0] for x in collections.requests] == ['units', 'units']
+
+
+def test_failed_prefetch_retried(collections):
+    collections.failures = ['currencies']
+    report = _masters()
+    report.prefetch('units', 'currencies')
+    assert list(report.units.keys()) == ['nos']
+    with pytest.raises(TallyNotAvailable):
+        report.currencies
+    assert list(report.currencies.keys()) == ['$']
+
+
+def test_refresh_collection(collections):
+    report = _masters()
+    units = report.units
+    index = report.items_by_unit('nos')
+    report.refresh('units')
+    assert report.units is not units
+    assert report.items_by_unit('nos') == index
+    assert [x[0] for x in collections.requests] == \
+        ['units', 'stockitems', 'units']
+    assert collections.requests[-1][1]['reuse_cache'] is False
+
+
+def test_refresh_all_mode_rejects_collections():
+    report = masters.TallyMasters('Test Company', fetch_mode='all')
+    with pytest.raises(ValueError):
+        report.refresh('units')
+
+
+def test_executor_created_once(monkeypatch):
+    monkeypatch.setattr(masters, '_collection_executor', None)
+    executors = []
+    threads = [threading.Thread(
+        target=lambda: executors.append(masters._executor())
+    ) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(executors) == 8
+    assert all(x is executors[0] for x in executors)
+    executors[0].shutdown()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason="requires asyncio")
+def test_afetch(collections):
+    import asyncio
+    report = _masters()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(report.afetch('units', 'currencies'))
+    finally:
+        loop.close()
+    assert 'units' in report.__dict__
+    assert 'currencies' in report.__dict__
+    assert sorted(x[0] for x in collections.requests) == \
+        ['currencies', 'units']
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Shared reports are created once for concurrent callers, are bounded in
+number and age, and are kept apart for different options.
+"""
+
+import time
+import threading
+
+import pytest
+
+from tendril.connectors.tally import ledgers
+from tendril.connectors.tally import masters
+from tendril.connectors.tally import stock
+from tendril.connectors.tally.utils import registry
+from tendril.connectors.tally.utils.registry import TallyRegistry
+from tendril.connectors.tally.utils.registry import registry_key
+
+
+def test_single_flight():
+    reg = TallyRegistry()
+    calls = []
+    started = threading.Event()
+
+    def _factory():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return object()
+
+    results = []
+
+    def _get():
+        results.append(reg.get('key', _factory))
+
+    threads = [threading.Thread(target=_get) for _ in range(8)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert len(results) == 8
+    assert all(x is results[0] for x in results)
+
+
+def test_lru_bound():
+    reg = TallyRegistry(maxsize=2)
+    reg.get('a', lambda: 1)
+    reg.get('b', lambda: 2)
+    reg.get('a', lambda: None)
+    reg.get('c', lambda: 3)
+    assert len(reg) == 2
+    assert 'b' not in reg
+    assert reg['a'] == 1
+    assert reg['c'] == 3
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(registry.time, 'time', lambda: now[0])
+    reg = TallyRegistry(ttl=60)
+    assert reg.get('a', lambda: 1) == 1
+    now[0] += 59
+    assert reg.get('a', lambda: 2) == 1
+    now[0] += 2
+    assert 'a' not in reg
+    assert reg.get('a', lambda: 3) == 3
+
+
+def test_force():
+    reg = TallyRegistry()
+    assert reg.get('a', lambda: 1) == 1
+    assert reg.get('a', lambda: 2) == 1
+    assert reg.get('a', lambda: 3, force=True) == 3
+    assert reg['a'] == 3
+
+
+def test_registry_key():
+    assert registry_key('Co', compact=True, lazy=False) == \
+        registry_key('Co', lazy=False, compact=True)
+    assert registry_key('Co') != registry_key('Co', compact=True)
+    assert hash(registry_key('Co', fields=['name'], filters={'a': 1}))
+
+
+class _Report(object):
+    def __init__(self, company_name, **kwargs):
+        self.company_name = company_name
+        self.kwargs = kwargs
+        self.compact = kwargs.get('compact', False)
+
+
+@pytest.mark.parametrize('module, cls, get', [
+    (masters, 'TallyMasters', masters.get_master),
+    (ledgers, 'TallyLedgersList', ledgers.get_list),
+    (stock, 'TallyStockPosition', stock.get_position),
+])
+def test_options_do_not_leak(monkeypatch, module, cls, get):
+    monkeypatch.setattr(module, cls, _Report)
+    company = 'Test Company {0}'.format(cls)
+    compact = get(company, compact=True)
+    assert compact.compact
+    default = get(company)
+    assert not default.compact
+    assert default is not compact
+    assert get(company) is default
+    assert get(company, compact=True) is compact
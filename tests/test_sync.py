@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Voucher stores keep an AlterID mark for each period they are synced for.
+"""
+
+from datetime import date
+from collections import namedtuple
+
+import arrow
+import pytest
+
+from tendril.connectors.tally import sync
+
+
+Voucher = namedtuple('Voucher', 'guid alterid isdeleted iscancelled')
+
+
+class _Collection(object):
+    # Stands in for the TDL filtered voucher collection, returning the
+    # vouchers of the requested period altered since the given mark.
+    vouchers = {}
+    requests = []
+
+    def __init__(self, company_name, dt=None, end_dt=None, alterid=0,
+                 **kwargs):
+        self.period = sync.TallyVoucherStore.period(dt, end_dt)
+        self.alterid = alterid
+        self.requests.append((self.period, alterid))
+
+    def iter_content(self, item):
+        for voucher in self.vouchers.get(self.period, []):
+            if voucher.alterid > self.alterid:
+                yield voucher
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    monkeypatch.setattr(_Collection, 'vouchers', {})
+    monkeypatch.setattr(_Collection, 'requests', [])
+    monkeypatch.setattr(sync, 'TallyVouchersCollection', _Collection)
+    return _Collection
+
+
+def test_marks_kept_per_period(collection):
+    fy19 = sync.TallyVoucherStore.period('FY19')
+    fy20 = sync.TallyVoucherStore.period('FY20')
+    collection.vouchers[fy19] = [Voucher('a', 5, False, False)]
+    collection.vouchers[fy20] = [Voucher('b', 9, False, False)]
+    store = sync.TallyVoucherStore('Test Company', persist=False)
+    assert store.sync('FY20') == 1
+    assert store.sync('FY19') == 1
+    assert store.alterids == {fy19: 5, fy20: 9}
+    assert store.alterid == 9
+    assert sorted(store.vouchers.keys()) == ['a', 'b']
+
+
+def test_first_sync_of_period_not_skipped(collection):
+    # Regression: a single mark per company skipped vouchers of another
+    # period altered before it.
+    fy19 = sync.TallyVoucherStore.period('FY19')
+    fy20 = sync.TallyVoucherStore.period('FY20')
+    collection.vouchers[fy20] = [Voucher('b', 9, False, False)]
+    collection.vouchers[fy19] = [Voucher('a', 5, False, False),
+                                 Voucher('c', 12, False, False)]
+    store = sync.TallyVoucherStore('Test Company', persist=False)
+    store.sync('FY20')
+    store.sync('FY19')
+    assert collection.requests == [(fy20, 0), (fy19, 0)]
+    assert sorted(store.vouchers.keys()) == ['a', 'b', 'c']
+
+    # Later syncs of each period resume from its own mark.
+    store.sync('FY19')
+    store.sync('FY20')
+    assert collection.requests[2:] == [(fy19, 12), (fy20, 9)]
+
+
+def test_deleted_vouchers_dropped(collection):
+    period = sync.TallyVoucherStore.period('FY20')
+    collection.vouchers[period] = [Voucher('a', 1, False, False),
+                                   Voucher('b', 2, False, True)]
+    store = sync.TallyVoucherStore('Test Company', persist=False)
+    store.sync('FY20')
+    assert sorted(store.vouchers.keys()) == ['a', 'b']
+    assert [v.guid for v in store.active()] == ['a']
+
+    collection.vouchers[period].append(Voucher('a', 3, True, False))
+    assert store.sync('FY20') == 1
+    assert list(store.vouchers.keys()) == ['b']
+    assert store.alterids[period] == 3
+
+
+def test_default_period_key_is_stable(monkeypatch):
+    # The default period runs from the start of the financial year to
+    # today, which moves forward between syncs.
+    def _today(today):
+        start = arrow.get(date(2019, 4, 1))
+        return lambda dt, end_dt: ((start, arrow.get(today)),
+                                   arrow.get(today))
+
+    monkeypatch.setattr(sync, 'get_date_range', _today(date(2019, 7, 10)))
+    early = sync.TallyVoucherStore.period()
+    monkeypatch.setattr(sync, 'get_date_range', _today(date(2019, 11, 2)))
+    assert sync.TallyVoucherStore.period() == early == '2019-04-01:'
+    assert sync.TallyVoucherStore.period(date(2019, 4, 1),
+                                         date(2019, 11, 2)) == \
+        '2019-04-01:2019-11-02'
+
+
+def test_cachename():
+    store = sync.TallyVoucherStore('Test Co. Pvt-Ltd', persist=False)
+    assert store.cachename == 'TallyVoucherStore.Test_Co_PvtLtd'
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Predicates compile to fixed TDL formulae, which are written into the
+request as SYSTEM formulae applied as filters to the collection.
+"""
+
+from datetime import date
+from decimal import Decimal
+
+import arrow
+import pytest
+from lxml import etree
+
+from tendril.connectors.tally import TallyReport
+from tendril.connectors.tally.utils.tdl import TallyField as F
+from tendril.connectors.tally.utils.tdl import TallyFormula
+from tendril.connectors.tally.utils.tdl import compile_filters
+from tendril.connectors.tally.utils.tdl import tdl_literal
+
+
+@pytest.mark.parametrize('predicate, formula', [
+    (F('PartyLedgerName') == 'Customer A',
+     '$PartyLedgerName = "Customer A"'),
+    (F('VoucherTypeName') != 'Sales',
+     'NOT ($VoucherTypeName = "Sales")'),
+    (F('Amount') < 10, '$Amount < 10'),
+    (F('Amount') <= 10.5, '$Amount <= 10.5'),
+    (F('Amount') > Decimal('10000.00'), '$Amount > 10000.00'),
+    (F('AlterID') >= 42, '$AlterID >= 42'),
+    (F('IsCancelled') == False, '$IsCancelled = No'),  # noqa: E712
+    (F('Date') >= date(2019, 4, 1), '$Date >= $$Date:"01-04-2019"'),
+    (F('Date') < arrow.get(date(2020, 3, 31)),
+     '$Date < $$Date:"31-03-2020"'),
+    (F('Narration').contains('urgent'), '$Narration Contains "urgent"'),
+    (F('Reference').startswith('PO'), '$Reference Starting With "PO"'),
+    (F('Reference').endswith('/19'), '$Reference Ending With "/19"'),
+    (F('PartyLedgerName').isin(['A', 'B']),
+     '($PartyLedgerName = "A") OR ($PartyLedgerName = "B")'),
+    ((F('Amount') > 10) & (F('Amount') < 20),
+     '($Amount > 10) AND ($Amount < 20)'),
+    ((F('Amount') > 10) | ~(F('IsOptional') == True),  # noqa: E712
+     '($Amount > 10) OR (NOT ($IsOptional = Yes))'),
+    (TallyFormula('$$IsSales:$VoucherTypeName'),
+     '$$IsSales:$VoucherTypeName'),
+])
+def test_formula(predicate, formula):
+    assert predicate.formula() == formula
+
+
+def test_compile_filters():
+    assert compile_filters(None) == {}
+    assert compile_filters(F('AlterID') > 5) == {
+        'TendrilFilter0': '$AlterID > 5'
+    }
+    assert compile_filters([F('AlterID') > 5, F('Amount') < 10],
+                           prefix='Test') == {
+        'Test0': '$AlterID > 5',
+        'Test1': '$Amount < 10',
+    }
+
+
+def _filters_xml(where):
+    tdlmessage = etree.Element('TDLMESSAGE')
+    collection = etree.SubElement(tdlmessage, 'COLLECTION')
+    TallyReport._build_tdl_filters(tdlmessage, collection,
+                                   compile_filters(where))
+    return etree.tostring(tdlmessage)
+
+
+def test_filters_xml():
+    assert _filters_xml([
+        F('PartyLedgerName') == 'Customer A',
+        (F('Amount') > 10000) | F('Narration').contains('urgent'),
+    ]) == (
+        b'<TDLMESSAGE><COLLECTION>'
+        b'<FILTER>TendrilFilter0</FILTER>'
+        b'<FILTER>TendrilFilter1</FILTER>'
+        b'</COLLECTION>'
+        b'<SYSTEM TYPE="Formulae" NAME="TendrilFilter0">'
+        b'$PartyLedgerName = "Customer A"</SYSTEM>'
+        b'<SYSTEM TYPE="Formulae" NAME="TendrilFilter1">'
+        b'($Amount &gt; 10000) OR ($Narration Contains "urgent")</SYSTEM>'
+        b'</TDLMESSAGE>'
+    )
+
+
+def test_filters_xml_escaping():
+    assert _filters_xml(F('PartyLedgerName') == 'A & B <Pvt> Ltd') == (
+        b'<TDLMESSAGE><COLLECTION>'
+        b'<FILTER>TendrilFilter0</FILTER>'
+        b'</COLLECTION>'
+        b'<SYSTEM TYPE="Formulae" NAME="TendrilFilter0">'
+        b'$PartyLedgerName = "A &amp; B &lt;Pvt&gt; Ltd"</SYSTEM>'
+        b'</TDLMESSAGE>'
+    )
+
+
+def test_quotes_rejected():
+    with pytest.raises(ValueError):
+        tdl_literal('10" Monitor')
+    with pytest.raises(ValueError):
+        (F('Narration') == 'said "yes"').formula()
+
+
+def test_unsupported_literal():
+    with pytest.raises(TypeError):
+        tdl_literal(None)
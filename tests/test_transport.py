@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Streamed responses return their pooled connection once they are read,
+closed or dropped, whether or not they were ever iterated.
+"""
+
+import gc
+
+from tendril.connectors.tally import _TallyResponseStream
+
+
+class _Response(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def _elements(n):
+    for i in range(n):
+        yield i
+
+
+def test_exhausted_stream_releases_connection():
+    response = _Response()
+    stream = _TallyResponseStream(response, _elements(3))
+    assert list(stream) == [0, 1, 2]
+    assert response.closed
+
+
+def test_unstarted_stream_releases_connection_on_close():
+    response = _Response()
+    stream = _TallyResponseStream(response, _elements(3))
+    stream.close()
+    assert response.closed
+    assert list(stream) == []
+
+
+def test_abandoned_stream_releases_connection():
+    response = _Response()
+    stream = _TallyResponseStream(response, _elements(3))
+    next(stream)
+    del stream
+    gc.collect()
+    assert response.closed
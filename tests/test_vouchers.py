@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (C) 2019 Chintalagiri Shashank
+#
+# This file is part of tendril-connector-tally.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Voucher lists fetched in shards present the same interface as a single
+voucher report.
+"""
+
+import sys
+import arrow
+import pytest
+from datetime import date
+
+from tendril.connectors.tally import TallyNotAvailable
+from tendril.connectors.tally import vouchers
+from tendril.connectors.tally.utils.dates import get_date_range
+
+
+class _Shard(object):
+    # Stands in for the voucher report of a single shard.
+    def __init__(self, dt=None, end_dt=None, failures=0, **kwargs):
+        self.dt = dt
+        self.end_dt = end_dt
+        self.failures = failures
+        self.released = False
+
+    @property
+    def vouchers(self):
+        if 'vouchers' not in self.__dict__:
+            if self.failures:
+                self.failures -= 1
+                raise TallyNotAvailable
+            self.__dict__['vouchers'] = {
+                str(self.dt.date()): self.dt.date()
+            }
+        return self.__dict__['vouchers']
+
+    def stream(self, item):
+        for obj in self.vouchers.values():
+            yield obj
+
+    def release(self):
+        self.released = True
+
+
+@pytest.fixture
+def shards(monkeypatch):
+    def _get_list(company_name, **kwargs):
+        return _Shard(**kwargs)
+    monkeypatch.setattr(vouchers, 'get_list', _get_list)
+
+
+def test_shards_clamped_to_today(shards):
+    today = arrow.get(date.today())
+    (_, end), _ = get_date_range()
+    report = vouchers.TallyShardedVouchersList('Test Company')
+    assert all(x.dt <= today for x in report.shards)
+    assert report.shards[-1].end_dt == end
+    if end > today:
+        assert report.shards[-1].dt >= today.floor('month')
+
+
+def test_past_range_not_clamped(shards):
+    report = vouchers.TallyShardedVouchersList(
+        'Test Company', dt=date(2019, 4, 1), end_dt=date(2019, 6, 30)
+    )
+    assert [(x.dt.date(), x.end_dt.date()) for x in report.shards] == [
+        (date(2019, 4, 1), date(2019, 4, 30)),
+        (date(2019, 5, 1), date(2019, 5, 31)),
+        (date(2019, 6, 1), date(2019, 6, 30)),
+    ]
+
+
+def test_retry_backoff(shards, monkeypatch):
+    delays = []
+    monkeypatch.setattr(vouchers.time, 'sleep', delays.append)
+    report = vouchers.TallyShardedVouchersList(
+        'Test Company', dt=date(2019, 4, 1), end_dt=date(2019, 4, 30),
+        retries=2, retry_delay=0.5
+    )
+    report.shards[0].failures = 2
+    assert list(report.vouchers.values()) == [date(2019, 4, 1)]
+    assert delays == [0.5, 1]
+
+    report = vouchers.TallyShardedVouchersList(
+        'Test Company', dt=date(2019, 4, 1), end_dt=date(2019, 4, 30),
+        retries=1, retry_delay=0.5
+    )
+    report.shards[0].failures = 2
+    with pytest.raises(TallyNotAvailable):
+        report.vouchers
+
+
+def test_report_interface(shards):
+    report = vouchers.TallyShardedVouchersList(
+        'Test Company', dt=date(2019, 4, 1), end_dt=date(2019, 5, 31)
+    )
+    expected = [date(2019, 4, 1), date(2019, 5, 1)]
+    assert list(report.stream('vouchers')) == expected
+    assert list(report.iter_content('vouchers')) == expected
+    assert list(report.vouchers.values()) == expected
+    report.release()
+    assert 'vouchers' not in report.__dict__
+    assert all(x.released for x in report.shards)
+    with pytest.raises(AttributeError):
+        list(report.stream('ledgers'))
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason="requires asyncio")
+def test_afetch(shards):
+    import asyncio
+    report = vouchers.TallyShardedVouchersList(
+        'Test Company', dt=date(2019, 4, 1), end_dt=date(2019, 5, 31)
+    )
+    loop = asyncio.new_event_loop()
+    try:
+        result = loop.run_until_complete(report.afetch())
+    finally:
+        loop.close()
+    assert result is report
+    assert 'vouchers' in report.__dict__